@@ -0,0 +1,99 @@
+"""Benchmark bulk loading a DataFrame with common.database_utils.write_dataframe_to_database
+(COPY on PostgreSQL), compared to the previous implementation (DataFrame.to_sql with
+a new engine). Reports throughput in rows per second, and checks the loaded rows.
+
+Usage: python benchmarks/bench_db_bulk.py [--connection URL] [--rows 100000]
+Without --connection, a temporary SQLite database is used, which has no COPY.
+Against an existing database, the benchmark creates (and drops) the table `bench_db_bulk`.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'flows'))
+from sqlalchemy import (Column, DateTime, Float, Integer, MetaData, Table, create_engine,
+                        func, select)
+from common import database_utils
+
+TABLE_NAME = 'bench_db_bulk'
+
+
+def reference_write(connection: str, table_name: str, df: pd.DataFrame):
+    """The previous write_dataframe_to_database."""
+    engine = create_engine(connection)
+    df.to_sql(table_name, engine, if_exists='append', index=False)
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """P1 meter like readings, one every 10 seconds, with some missing values."""
+    rng = np.random.default_rng(0)
+    power = rng.gamma(2, 0.2, rows)
+    return pd.DataFrame({
+        "datetime": pd.date_range("2025-01-01", periods=rows, freq="10s", tz="UTC"),
+        "power_delivered": power,
+        "energy_delivered": 10_000 + np.cumsum(power) / 360,
+        "gas_delivered": np.where(np.arange(rows) % 30 == 0, 2000 + np.arange(rows) / 10_000, np.nan),
+        "phase": rng.integers(1, 4, rows),
+    })
+
+def create_table(engine) -> Table:
+    table = Table(TABLE_NAME, MetaData(),
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('datetime', DateTime(timezone=True), nullable=False, unique=True),
+        Column('power_delivered', Float),
+        Column('energy_delivered', Float),
+        Column('gas_delivered', Float),
+        Column('phase', Integer))
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    database_utils.invalidate_tables()
+    return table
+
+def count_rows(engine, table) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar_one()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connection', help="SQLAlchemy URL, default a temporary SQLite database")
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+    connection = args.connection or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(connection)
+    df = make_dataframe(args.rows)
+
+    runs = {
+        "reference (to_sql)": lambda: reference_write(connection, TABLE_NAME, df),
+        "write_dataframe": lambda: database_utils.write_dataframe_to_database(connection, TABLE_NAME, df),
+        "write_dataframe (merge)": lambda: database_utils.write_dataframe_to_database(
+            connection, TABLE_NAME, df, ignore_duplicates=True),
+    }
+    results = {}
+    for name, run in runs.items():
+        table = create_table(engine)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if "merge" in name:
+                # Half of the rows exist already
+                database_utils.write_dataframe_to_database(connection, TABLE_NAME, df.iloc[::2])
+            start = time.perf_counter()
+            run()
+            duration = time.perf_counter() - start
+        written = count_rows(engine, table)
+        assert written == len(df), f"{name}: expected {len(df)} rows, found {written}"
+        results[name] = len(df) / duration
+    table.drop(engine)
+    database_utils.dispose_engines()
+
+    print(f"{args.rows} rows into {engine.dialect.name}:")
+    for name, rows_per_second in results.items():
+        print(f"{name:>24}: {rows_per_second:12,.0f} rows/s")
+    print(f"speedup: {results['write_dataframe'] / results['reference (to_sql)']:.1f}x")
+
+if __name__ == "__main__":
+    main()
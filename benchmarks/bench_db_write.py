@@ -0,0 +1,100 @@
+"""Benchmark writing single rows with common.database_utils.write_to_database,
+compared to the previous implementation (a new engine and a reflection of the
+table for every row). Counts the statements and new connections per insert.
+
+Usage: python benchmarks/bench_db_write.py [--connection URL] [--rows 200]
+Without --connection, a temporary SQLite database is used. Against an existing
+database, the benchmark creates (and drops) the table `bench_db_write`.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'flows'))
+from sqlalchemy import Column, DateTime, Engine, Float, Integer, MetaData, Table, create_engine, event, insert
+from sqlalchemy.pool import Pool
+from common import database_utils
+
+TABLE_NAME = 'bench_db_write'
+counts = {"statements": 0, "connects": 0}
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_statement(*args):
+    counts["statements"] += 1
+
+@event.listens_for(Pool, "connect")
+def count_connect(*args):
+    counts["connects"] += 1
+
+
+def reference_write(connection: str, table_name: str, row: dict):
+    """The previous write_to_database (without the unique error handling)."""
+    engine = create_engine(connection)
+    with engine.begin() as conn:
+        metadata = MetaData()
+        metadata.reflect(bind=conn, only=[table_name])
+        conn.execute(insert(metadata.tables[table_name]).values(**row))
+
+def create_table(connection: str):
+    engine = create_engine(connection)
+    metadata = MetaData()
+    table = Table(TABLE_NAME, metadata,
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('timestamp', DateTime, nullable=False),
+        Column('power', Float),
+        Column('gas', Float))
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    engine.dispose()
+    return table
+
+def run(write, connection: str, rows: int) -> dict:
+    counts.update(statements=0, connects=0)
+    durations = []
+    start_time = datetime(2026, 1, 1)
+    for i in range(rows):
+        row = {"timestamp": start_time + timedelta(minutes=5 * i), "power": 0.1 * i, "gas": 0.01 * i}
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            write(connection, TABLE_NAME, row)
+        durations.append(time.perf_counter() - start)
+    return {
+        "median_ms": 1000 * statistics.median(durations),
+        "first_ms": 1000 * durations[0],
+        "statements_per_row": counts["statements"] / rows,
+        "connects_per_row": counts["connects"] / rows,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connection', help="SQLAlchemy URL, default a temporary SQLite database")
+    parser.add_argument('--rows', type=int, default=200)
+    args = parser.parse_args()
+    connection = args.connection or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    table = create_table(connection)
+    results = {
+        "reference": run(reference_write, connection, args.rows),
+        "write_to_database": run(database_utils.write_to_database, connection, args.rows),
+    }
+    database_utils.dispose_engines()
+    engine = create_engine(connection)
+    with engine.connect() as conn:
+        written = len(conn.execute(table.select()).all())
+    table.drop(engine)
+
+    for name, result in results.items():
+        print(f"{name:>18}: {result['median_ms']:8.3f} ms/row (first {result['first_ms']:.1f} ms), "
+              f"{result['statements_per_row']:.2f} statements/row, {result['connects_per_row']:.2f} connects/row")
+    print(f"speedup: {results['reference']['median_ms'] / results['write_to_database']['median_ms']:.1f}x")
+    assert written == 2 * args.rows, f"expected {2 * args.rows} rows, found {written}"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Benchmark the ESP32 frame encoder against the original pure Python version,
+and check that both produce exactly the same output.
+
+Usage: python benchmarks/bench_esp32_encode.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'flows'))
+from eidash.esp32_client import encode_bit_array
+
+
+def encode_bit_array_reference(bits):
+    # The original string based implementation
+    char_map = {format(i, '04b'): chr(ord('a') + i) for i in range(16)}
+    bin_str = ''.join(['1' if bit else '0' for bit in bits])
+    groups = [bin_str[i:i+4] for i in range(0, len(bin_str), 4)]
+    result = ''.join([char_map[group] for group in groups])
+    result = ''.join([result[i:i+2][::-1] for i in range(0, len(result), 2)])
+    return result
+
+def check_equivalence():
+    rng = np.random.default_rng(0)
+    for n in [4, 8, 12, 4000, 800 * 480]:
+        bits = rng.integers(0, 2, n).astype(bool)
+        assert encode_bit_array(bits) == encode_bit_array_reference(bits), n
+    for fill in [False, True]:
+        bits = np.full(800 * 480, fill)
+        assert encode_bit_array(bits) == encode_bit_array_reference(bits), fill
+    print("Output identical to reference implementation")
+
+def main():
+    check_equivalence()
+    bits = np.random.default_rng(1).integers(0, 2, 800 * 480).astype(bool)
+    for name, func, number in [("reference", encode_bit_array_reference, 5),
+                               ("numpy", encode_bit_array, 200)]:
+        seconds = min(timeit.repeat(lambda: func(bits), number=number, repeat=3)) / number
+        print(f"{name:>10}: {seconds * 1000:8.3f} ms per 800x480 frame")
+
+if __name__ == "__main__":
+    main()
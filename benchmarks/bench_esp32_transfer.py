@@ -0,0 +1,56 @@
+"""Benchmark uploading frames to the ESP32 emulator.
+
+Reports requests per second and the end-to-end upload time per frame,
+and checks that the frame shown by the emulator is the frame that was sent.
+
+Usage: python benchmarks/bench_esp32_transfer.py [--frames 5] [--latency 0.02] [--drop-rate 0.01]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'flows'))
+from eidash.esp32_client import send_frame
+from eidash.esp32_emulator import ESP32Emulator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    emulator = ESP32Emulator(latency=args.latency, drop_rate=args.drop_rate,
+        timeout_rate=args.timeout_rate, seed=0)
+    os.environ['EI_ESP32_HOST'] = emulator.start()
+
+    rng = np.random.default_rng(0)
+    durations = []
+    retries = restarts = 0
+    correct = 0
+    for _ in range(args.frames):
+        bits = rng.integers(0, 2, (480, 800)).astype(bool)
+        packed = np.packbits(bits.reshape(-1)).tobytes()
+        n_shown = len(emulator.frames)
+        start = time.perf_counter()
+        stats = send_frame(packed)
+        durations.append(time.perf_counter() - start)
+        retries += stats["retries"]
+        restarts += stats["restarts"]
+        if len(emulator.frames) > n_shown and np.array_equal(np.asarray(emulator.frames[-1]), bits):
+            correct += 1
+    emulator.stop()
+
+    total = sum(durations)
+    print(f"frames sent:      {args.frames} ({correct} shown correctly)")
+    print(f"requests:         {emulator.stats['requests']} ({emulator.stats['requests'] / total:.1f}/s)")
+    print(f"frame upload:     mean {1000 * total / len(durations):.1f} ms, max {1000 * max(durations):.1f} ms")
+    print(f"client:           {retries} retries, {restarts} restarts")
+    print(f"emulator stats:   {emulator.stats}")
+
+if __name__ == "__main__":
+    main()
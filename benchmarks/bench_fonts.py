@@ -0,0 +1,52 @@
+"""Benchmark font loading and fill sizing in the render path,
+before (uncached ImageFont.truetype, linear search) and after
+(shared font cache, binary search).
+
+Usage: EI_FONT=/path/to/font.ttf python benchmarks/bench_fonts.py
+"""
+import os
+import sys
+import timeit
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'flows'))
+from eidash.draw.image_text import ImageText, get_font, getsize
+
+FONT = os.environ['EI_FONT']
+ICON_FONT = os.path.join(os.path.dirname(__file__), '..', 'src', 'flows', 'eidash', 'fonts', 'weather-iconic.ttf')
+FONTS = [(FONT, 30), (FONT, 18), (ICON_FONT, 80), (ICON_FONT, 40)]
+
+
+def get_font_size_reference(text, font_filename, max_width):
+    # The original linear search, loading the font for every size
+    font_size = 1
+    while True:
+        text_size = getsize(ImageFont.truetype(font_filename, font_size), text)
+        if text_size[0] >= max_width:
+            return font_size - 1
+        font_size += 1
+
+def load_fonts_uncached():
+    return [ImageFont.truetype(path, size=size) for path, size in FONTS]
+
+def load_fonts_cached():
+    return [get_font(path, size) for path, size in FONTS]
+
+def report(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{name:>32}: {seconds * 1000:9.4f} ms")
+
+def main():
+    image = Image.new('1', (800, 480), 1)
+    image_text = ImageText(image, ImageDraw.Draw(image))
+    text = "Zwaar bewolkt"
+    assert image_text.get_font_size(text, FONT, max_width=300) == get_font_size_reference(text, FONT, 300)
+
+    report("HKDraw fonts, uncached", load_fonts_uncached, 20)
+    report("HKDraw fonts, cached", load_fonts_cached, 1000)
+    report("fill sizing, linear uncached", lambda: get_font_size_reference(text, FONT, 300), 3)
+    report("fill sizing, binary search", lambda: image_text.get_font_size(text, FONT, max_width=300), 20)
+    print(get_font.cache_info())
+
+if __name__ == "__main__":
+    main()
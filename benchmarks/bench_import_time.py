@@ -0,0 +1,84 @@
+"""Measure the import time of every deployment entry point in prefect.yaml
+with `python -X importtime`, and fail when one exceeds its budget.
+
+Usage: python benchmarks/bench_import_time.py [--budget 2.5] [--repeat 3]
+Exits with status 1 if an entry point takes longer than the budget (seconds).
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Import a flow module by path, like Prefect does, without running it
+IMPORT_SCRIPT = """
+import importlib.util, os, sys
+path = sys.argv[1]
+sys.path.insert(0, os.path.dirname(path))
+spec = importlib.util.spec_from_file_location("__entrypoint__", path)
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+"""
+
+
+def get_entrypoints() -> list[str]:
+    with open(os.path.join(ROOT, 'prefect.yaml')) as config_file:
+        return re.findall(r'^\s*entrypoint:\s*(\S+?):\w+\s*$', config_file.read(), re.MULTILINE)
+
+def measure(path: str) -> tuple[float, list[tuple[float, str]]]:
+    """Total import time in seconds, and the cumulative time of each top-level import."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT, path],
+        cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)$', line)
+        if match:
+            # Top-level imports are not indented
+            imports.append((int(match.group(1)) / 1e6, match.group(2)))
+    return sum(seconds for seconds, _ in imports), sorted(imports, reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=2.5, help="maximum import time per entry point (seconds)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per entry point, the fastest counts")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for entrypoint in get_entrypoints():
+        path = os.path.join(ROOT, entrypoint)
+        if not os.path.exists(path):
+            results[entrypoint] = {"error": "file not found"}
+            continue
+        try:
+            runs = [measure(path) for _ in range(args.repeat)]
+        except RuntimeError as err:
+            results[entrypoint] = {"error": str(err)}
+            continue
+        total, imports = min(runs)
+        results[entrypoint] = {
+            "seconds": round(total, 3),
+            "over_budget": total > args.budget,
+            "slowest": [[name, round(seconds, 3)] for seconds, name in imports[:5]],
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for entrypoint, result in results.items():
+            if "error" in result:
+                print(f"{entrypoint:<40} ERROR {result['error']}")
+                continue
+            flag = "OVER BUDGET" if result["over_budget"] else "ok"
+            slowest = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in result["slowest"][:3])
+            print(f"{entrypoint:<40} {result['seconds']:6.2f}s  {flag:<11}  ({slowest})")
+
+    if any(result.get("over_budget") for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
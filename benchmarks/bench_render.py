@@ -0,0 +1,185 @@
+"""Benchmark rendering the e-ink dashboard from recorded fixture data.
+
+Times HKDraw.draw_data end to end (cold: no cached tiles or layers, and warm:
+nothing changed since the previous frame), every widget separately, and text box
+layout. The current time is frozen, so frames are reproducible and can be compared
+with golden images, to confirm that optimizations don't change any pixels.
+
+Usage:
+    EI_FONT=/path/to/font.ttf python benchmarks/bench_render.py [--output results.json]
+    ... --update-golden     store the current frames as golden images
+    ... --record            record new fixture data from the live sources (needs .env)
+Exits with status 1 if a frame differs from its golden image.
+"""
+import argparse
+import copy
+import datetime
+import json
+import locale
+import os
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image, ImageChops
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+GOLDEN = os.path.join(ROOT, 'benchmarks', 'golden')
+FROZEN_NOW = datetime.datetime(2026, 10, 18, 12, 0)
+
+# Render with empty caches that don't touch the real cache directory
+os.environ['DF_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench_render_')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'flows'))
+from eidash.draw import hkdraw, date_time, weather, birthdays, layers, tiles
+from eidash.draw.hkdraw import HKDraw
+from eidash.draw.drawcontext import DrawContext
+
+
+class FrozenDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return FROZEN_NOW if tz is None else FROZEN_NOW.replace(tzinfo=tz)
+
+for module in (hkdraw, date_time, weather, birthdays):
+    module.datetime = FrozenDatetime
+
+
+class TimedHKDraw(HKDraw):
+    """HKDraw that records the time spent drawing each widget."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.widget_times = {}
+
+    def draw_tile(self, call):
+        start = time.perf_counter()
+        try:
+            return super().draw_tile(call)
+        finally:
+            self.widget_times[call["name"]] = time.perf_counter() - start
+
+
+def load_fixture() -> dict:
+    with open(os.path.join(FIXTURES, 'eidash_data.json')) as fixture_file:
+        data = json.load(fixture_file)
+    data["sunspot_image"] = np.asarray(Image.open(os.path.join(FIXTURES, 'sunspot_image.png')))
+    return data
+
+def record_fixture():
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("eidash_flow", os.path.join(ROOT, 'src', 'flows', 'eidash.py'))
+    eidash_flow = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(eidash_flow)
+    data = eidash_flow.fetch_data.fn()
+    for key in ("timings", "stale"):
+        data.pop(key, None)
+    sunspot_image = data.pop("sunspot_image")
+    if isinstance(sunspot_image, np.ndarray):
+        Image.fromarray(sunspot_image).save(os.path.join(FIXTURES, 'sunspot_image.png'))
+    with open(os.path.join(FIXTURES, 'eidash_data.json'), 'w') as fixture_file:
+        json.dump(data, fixture_file, indent=2, ensure_ascii=False, default=str)
+    print(f"Recorded fixture data for: {', '.join(data)}")
+
+def clear_caches():
+    layers._layers.clear()
+    tiles._tiles.clear()
+    for root, _, files in os.walk(os.environ['DF_CACHE_DIR']):
+        for name in files:
+            os.remove(os.path.join(root, name))
+
+def new_hkdraw() -> TimedHKDraw:
+    return TimedHKDraw(width=800, height=480, font_dir=os.path.join(ROOT, 'src', 'flows', 'eidash', 'fonts'))
+
+def time_runs(func, repeat) -> dict:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {"median_ms": round(1000 * statistics.median(durations), 3),
+            "min_ms": round(1000 * min(durations), 3)}
+
+def benchmark(data, repeat) -> tuple[dict, dict]:
+    results = {}
+    frames = {}
+
+    # Cold: every widget and static layer is drawn
+    widget_times = {}
+    def draw_cold():
+        clear_caches()
+        drawer = new_hkdraw()
+        drawer.draw_data(copy.deepcopy(data))
+        for name, seconds in drawer.widget_times.items():
+            widget_times.setdefault(name, []).append(seconds)
+        frames["cold"] = drawer.context.image.copy()
+    results["draw_data_cold"] = time_runs(draw_cold, repeat)
+    results["widgets"] = {name: {"median_ms": round(1000 * statistics.median(times), 3)}
+                          for name, times in sorted(widget_times.items(), key=lambda item: -statistics.median(item[1]))}
+
+    # Warm: same inputs as the previous frame, all tiles are reused
+    drawer = new_hkdraw()
+    def draw_warm():
+        drawer.draw_data(copy.deepcopy(data))
+        frames["warm"] = drawer.context.image.copy()
+    results["draw_data_warm"] = time_runs(draw_warm, repeat)
+
+    # Text box layout of the forecast text
+    context = drawer.context
+    text = f'Verw: {data["weather"]["verw"]} | {data["knmi_warnings"]["text"]}'
+    results["layout_text_box"] = time_runs(
+        lambda: context.image_text.layout_text_box(text, 300, context.font_small), repeat)
+    scratch = DrawContext(800, 480)
+    results["write_text_box"] = time_runs(
+        lambda: scratch.image_text.write_text_box(490, 150, text, 300, context.font_small, color=0), repeat)
+    return results, frames
+
+def compare_golden(frames, update) -> dict:
+    os.makedirs(GOLDEN, exist_ok=True)
+    comparison = {}
+    for name, frame in frames.items():
+        path = os.path.join(GOLDEN, f"eidash_{name}.png")
+        if update or not os.path.exists(path):
+            frame.save(path)
+            comparison[name] = "stored"
+            continue
+        with Image.open(path) as golden:
+            diff = ImageChops.difference(frame.convert('L'), golden.convert('L'))
+        box = diff.getbbox()
+        comparison[name] = "identical" if box is None else f"differs in {box}"
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--update-golden', action='store_true')
+    parser.add_argument('--record', action='store_true')
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixture()
+        return
+
+    try:
+        locale.setlocale(locale.LC_TIME, "nl_NL.utf8")
+    except locale.Error:
+        print("Locale nl_NL.utf8 not available, using the default")
+
+    results, frames = benchmark(load_fixture(), args.repeat)
+    results["golden"] = compare_golden(frames, args.update_golden)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    for name in ("draw_data_cold", "draw_data_warm", "layout_text_box", "write_text_box"):
+        print(f"{name:>24}: {results[name]['median_ms']:9.3f} ms")
+    for name, result in results["widgets"].items():
+        print(f"{name:>24}: {result['median_ms']:9.3f} ms")
+    print(f"golden images: {results['golden']}")
+    if any(result.startswith("differs") for result in results["golden"].values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
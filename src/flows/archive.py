@@ -0,0 +1,124 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from prefect import flow, task
+import os
+import json
+from datetime import date, datetime, time, timedelta, timezone
+from typing import TYPE_CHECKING
+from common.database_utils import get_engine, get_time_series_tables
+from common.metrics_utils import measure
+
+# pandas (and pyarrow, for Parquet) are imported when exporting
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rows are read from a server-side cursor in chunks of this many rows
+CHUNK_ROWS = 50_000
+
+# Only whole days (UTC) are archived, that ended at least this long ago,
+# so readings that arrive a bit late (e.g. from the spool) are included
+ARCHIVE_DELAY = timedelta(hours=1)
+
+
+def get_archive_dir(*subdirs: str) -> str:
+    archive_dir = os.path.join(os.getenv("DF_ARCHIVE_DIR", "archive"), *subdirs)
+    os.makedirs(archive_dir, exist_ok=True)
+    return archive_dir
+
+def get_day_path(table_name: str, day: date) -> str:
+    """E.g. archive/p1_meter/2026/10/18.parquet"""
+    return os.path.join(get_archive_dir(table_name, f"{day:%Y}", f"{day:%m}"), f"{day:%d}.parquet")
+
+def load_checkpoint(table_name: str) -> datetime | None:
+    """Start of the first day that hasn't been archived yet, if any day has."""
+    try:
+        with open(os.path.join(get_archive_dir(table_name), "checkpoint.json")) as checkpoint_file:
+            return datetime.fromisoformat(json.load(checkpoint_file)["archived_until"])
+    except FileNotFoundError:
+        return None
+
+def store_checkpoint(table_name: str, archived_until: datetime):
+    path = os.path.join(get_archive_dir(table_name), "checkpoint.json")
+    with open(f"{path}.tmp", "w") as checkpoint_file:
+        json.dump({"archived_until": archived_until.isoformat()}, checkpoint_file)
+    os.replace(f"{path}.tmp", path)
+
+def write_day(table_name: str, day: date, frames: list["pd.DataFrame"]) -> int:
+    """Write the rows of a day to its Parquet file (replacing it, if a previous
+        export was interrupted before its checkpoint) and return the number of rows."""
+    import pandas as pd
+    df = pd.concat(frames, ignore_index=True)
+    path = get_day_path(table_name, day)
+    df.to_parquet(f"{path}.tmp", engine="pyarrow", compression="zstd", index=False)
+    os.replace(f"{path}.tmp", path)
+    return len(df)
+
+@task
+def export_table(connection: str, table_name: str, column: str, until: datetime) -> dict:
+    """Export the rows of the days after the checkpoint, up to `until` (the start of a day),
+        one Parquet file per day. Memory use is bounded by a day of rows plus a chunk."""
+    import pandas as pd
+    from sqlalchemy import text
+    engine = get_engine(connection)
+    quote = engine.dialect.identifier_preparer.quote
+    start = load_checkpoint(table_name)
+    if start is not None and start >= until:
+        print(f"Archive of {table_name} is up to date")
+        return {"days": 0, "rows": 0}
+    query = text(f"SELECT * FROM {quote(table_name)} "
+                 f"WHERE {quote(column)} >= :start AND {quote(column)} < :until ORDER BY {quote(column)}")
+    result = {"days": 0, "rows": 0}
+
+    def finish_day(day, frames):
+        result["rows"] += write_day(table_name, day, frames)
+        result["days"] += 1
+        store_checkpoint(table_name, datetime.combine(day + timedelta(days=1), time(), tzinfo=timezone.utc))
+
+    with measure("archive.export", table=table_name) as metric, \
+            engine.connect().execution_options(stream_results=True, max_row_buffer=CHUNK_ROWS) as conn:
+        params = {"start": start or datetime.min.replace(tzinfo=timezone.utc), "until": until}
+        day, frames = None, []
+        for chunk in pd.read_sql(query, conn, params=params, chunksize=CHUNK_ROWS):
+            chunk[column] = pd.to_datetime(chunk[column], utc=True)
+            for chunk_day, rows in chunk.groupby(chunk[column].dt.date, sort=True):
+                if day is not None and chunk_day != day:
+                    finish_day(day, frames)
+                    frames = []
+                day = chunk_day
+                frames.append(rows)
+        if frames:
+            finish_day(day, frames)
+        metric["rows"] = result["rows"]
+    # Days without rows are skipped, and not exported again
+    store_checkpoint(table_name, until)
+    print(f"Archived {table_name}: {result}")
+    return result
+
+def read_archive(table_name: str, start: date = None, end: date = None) -> "pd.DataFrame":
+    """Read the archived days of a table from start up to and including end."""
+    import pandas as pd
+    root = get_archive_dir(table_name)
+    paths = []
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if not name.endswith(".parquet"):
+                continue
+            year, month = os.path.relpath(directory, root).split(os.sep)
+            day = date(int(year), int(month), int(name.removesuffix(".parquet")))
+            if (start is None or day >= start) and (end is None or day <= end):
+                paths.append(os.path.join(directory, name))
+    if not paths:
+        return pd.DataFrame()
+    return pd.concat((pd.read_parquet(path) for path in paths), ignore_index=True)
+
+@flow(name="Archive")
+def archive():
+    connection = os.getenv("DATABASE_CONNECTION")
+    now = datetime.now(tz=timezone.utc)
+    until = datetime.combine((now - ARCHIVE_DELAY).date(), time(), tzinfo=timezone.utc)
+    for table_name, column in get_time_series_tables().items():
+        export_table(connection, table_name, column, until)
+
+if __name__ == "__main__":
+    archive()
@@ -2,9 +2,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from prefect import flow, task
-import requests
 import os
 from datetime import date
+from common.api_utils import get
 from common.ntfy_utils import send_notification
 
 
@@ -13,7 +13,7 @@ def get_birthdays(month: int, day: int) -> dict:
     postgrest_url = os.getenv("POSTGREST_URL")
     url = f"{postgrest_url}/birthdays?month=eq.{month}&day=eq.{day}"
     print(f"Fetching birthdays from: {url}")
-    response = requests.get(url)
+    response = get(url)
 
     if response.status_code != 200:
         print(f"Failed to fetch birthdays: {response.status_code} - {response.text}")
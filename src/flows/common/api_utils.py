@@ -1,15 +1,81 @@
+import threading
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
+from common.metrics_utils import measure
 
-def fetch_text(endpoint: str) -> str:
-    response = requests.get(endpoint)
-    if response.status_code != 200:
-        print(f"Failed to fetch data: {response.status_code} - {response.text}")
-        raise Exception("Failed to fetch data")
-    return response.text.strip()
-
-def fetch_json(endpoint: str, headers: dict = None, verify_ssl: bool = True, params: dict = None) -> dict:
-    response = requests.get(endpoint, headers=headers, verify=verify_ssl, params=params)
-    if response.status_code != 200:
-        print(f"Failed to fetch data: {response.status_code} - {response.text}")
-        raise Exception("Failed to fetch data")
-    return response.json()
+# (connect, read) timeouts in seconds, used unless a call passes its own
+DEFAULT_TIMEOUT = (5, 30)
+
+# Maximum number of pooled (keep-alive) connections per host
+POOL_MAXSIZE = 4
+
+# One session per scheme + host, shared by all flows in this process
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url: str) -> requests.Session:
+    """Return the shared session for the host of the given url,
+        creating it (with its own connection pool) on first use."""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount(f"{parts.scheme}://", adapter)
+            _sessions[key] = session
+    return session
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+def request(method: str, url: str, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """Perform a request through the shared session for the url's host.
+        `timeout` is either a single number or a (connect, read) tuple;
+        all other arguments are passed on to `requests.Session.request`."""
+    return get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+def fetch_text(endpoint: str, timeout=DEFAULT_TIMEOUT) -> str:
+    with measure("http.fetch_text", host=urlsplit(endpoint).netloc) as metric:
+        response = get(endpoint, timeout=timeout)
+        metric["bytes"] = len(response.content)
+        if response.status_code != 200:
+            print(f"Failed to fetch data: {response.status_code} - {response.text}")
+            raise Exception("Failed to fetch data")
+        return response.text.strip()
+
+def fetch_json(endpoint: str, headers: dict = None, verify_ssl: bool = True, params: dict = None,
+               timeout=DEFAULT_TIMEOUT) -> dict:
+    with measure("http.fetch_json", host=urlsplit(endpoint).netloc) as metric:
+        response = get(endpoint, headers=headers, verify=verify_ssl, params=params, timeout=timeout)
+        metric["bytes"] = len(response.content)
+        if response.status_code != 200:
+            print(f"Failed to fetch data: {response.status_code} - {response.text}")
+            raise Exception("Failed to fetch data")
+        return response.json()
+
+def fetch_to_file(endpoint: str, path: str, chunk_size: int = 64 * 1024, timeout=DEFAULT_TIMEOUT) -> int:
+    """Stream the response body to a file without holding it in memory.
+        Returns the number of bytes written."""
+    written = 0
+    with measure("http.fetch_to_file", host=urlsplit(endpoint).netloc) as metric:
+        with get(endpoint, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as target_file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    target_file.write(chunk)
+                    written += len(chunk)
+        metric["bytes"] = written
+    return written
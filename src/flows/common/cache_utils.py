@@ -0,0 +1,43 @@
+import os
+import pickle
+import time
+
+
+def get_cache_dir(*subdirs: str) -> str:
+    cache_dir = os.path.join(os.getenv("DF_CACHE_DIR", "cache"), *subdirs)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def _get_path(key: str) -> str:
+    return os.path.join(get_cache_dir("last_known_good"), f"{key}.pickle")
+
+def store_value(key: str, value) -> None:
+    """Store the last known good value for a key, together with the current time.
+        The file is replaced atomically, so a reader never sees a partial write."""
+    path = _get_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as cache_file:
+        pickle.dump({"timestamp": time.time(), "value": value}, cache_file)
+    os.replace(tmp_path, path)
+
+def load_value(key: str, max_age: float = None):
+    """Load the last known good value for a key.
+
+    Returns:
+        (value, age in seconds), or None if there is no value
+        or it is older than max_age.
+    """
+    path = _get_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as cache_file:
+            entry = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError) as err:
+        print(f"Could not read cached value for {key}: {err}")
+        return None
+    age = time.time() - entry["timestamp"]
+    if max_age is not None and age > max_age:
+        return None
+    return entry["value"], age
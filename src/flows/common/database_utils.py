@@ -1,31 +1,307 @@
+import io
+import os
+import threading
 from datetime import datetime
-from sqlalchemy import MetaData, create_engine, insert
-from sqlalchemy.exc import IntegrityError
-import pandas as pd
+from typing import TYPE_CHECKING
+from common.metrics_utils import measure
 
-def write_to_database(connection: str, table_name: str, row: dict, ignore_unique_error: bool = False):
-    engine = create_engine(connection)
-    with engine.begin() as conn:
-        # Get table from database
+# SQLAlchemy and pandas are imported in the functions that use them,
+# so importing a flow doesn't pay for them until it writes to the database
+if TYPE_CHECKING:
+    import pandas as pd
+    from sqlalchemy import Engine, Table
+
+# Connection pool per engine: the flows write a row every few minutes, so a
+# couple of connections is plenty. Connections older than POOL_RECYCLE seconds
+# are replaced on checkout, instead of pinging the server before every use.
+POOL_SIZE = 2
+POOL_MAX_OVERFLOW = 2
+POOL_RECYCLE = 30 * 60
+
+# Bulk loading with COPY: rows rendered as CSV at a time, and the size of the
+# blocks sent to the server. COPY_NULL marks missing values (not empty strings).
+COPY_CHUNK_ROWS = 10_000
+COPY_BUFFER_SIZE = 64 * 1024
+COPY_NULL = "\\N"
+
+# One engine per connection string, and the reflected tables per engine
+_engines = {}
+_tables = {}
+_lock = threading.Lock()
+
+
+def get_engine(connection: str) -> "Engine":
+    """Return the shared engine for the connection string, creating it on first use."""
+    with _lock:
+        engine = _engines.get(connection)
+        if engine is None:
+            from sqlalchemy import create_engine, make_url
+            options = {"pool_recycle": POOL_RECYCLE}
+            if make_url(connection).get_backend_name() != "sqlite":
+                options.update(pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW)
+            engine = create_engine(connection, **options)
+            _engines[connection] = engine
+    return engine
+
+def get_table(connection: str, table_name: str) -> "Table":
+    """Return the table, reflected from the database on first use."""
+    key = (connection, table_name)
+    table = _tables.get(key)
+    if table is None:
+        from sqlalchemy import MetaData
         metadata = MetaData()
-        metadata.reflect(bind=conn, only=[table_name])
+        metadata.reflect(bind=get_engine(connection), only=[table_name])
         table = metadata.tables[table_name]
+        with _lock:
+            _tables[key] = table
+    return table
+
+def invalidate_tables(connection: str = None, table_name: str = None):
+    """Forget reflected tables (of one connection, or one table), e.g. after a schema change."""
+    with _lock:
+        for key in list(_tables):
+            if connection in (None, key[0]) and table_name in (None, key[1]):
+                del _tables[key]
+
+def dispose_engines():
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _tables.clear()
+
+def get_time_series_tables() -> dict[str, str]:
+    """The tables of the meter and weather flows, with their time column."""
+    tables = {
+        os.getenv("HW_P1_TABLE"): "created_at",
+        os.getenv("HW_WATER_TABLE"): "created_at",
+        os.getenv("EN_DB_TABLE"): "datetime",
+        os.getenv("WL_TABLE"): "datetime",
+    }
+    return {table: column for table, column in tables.items() if table}
+
+def get_watermark(conn, name: str) -> datetime | None:
+    """The watermark of a job, locked until the end of the transaction, so runs don't overlap."""
+    from sqlalchemy import text
+    conn.execute(text("INSERT INTO watermarks (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+                 {"name": name})
+    return conn.execute(text("SELECT watermark FROM watermarks WHERE name = :name FOR UPDATE"),
+                        {"name": name}).scalar_one()
+
+def set_watermark(conn, name: str, watermark: datetime | None):
+    from sqlalchemy import text
+    conn.execute(text("UPDATE watermarks SET watermark = :watermark, updated_at = now() WHERE name = :name"),
+                 {"name": name, "watermark": watermark})
+
+def write_to_database(connection: str, table_name: str, row: dict, ignore_unique_error: bool = False):
+    from sqlalchemy import insert
+    from sqlalchemy.exc import IntegrityError, CompileError, ProgrammingError
+    engine = get_engine(connection)
+    with measure("db.write", table=table_name):
+        # A single INSERT is atomic, so it runs in autocommit mode: no BEGIN/COMMIT round trips
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            try:
+                try:
+                    conn.execute(insert(get_table(connection, table_name)).values(**row))
+                except (CompileError, ProgrammingError):
+                    # The cached table may be outdated (e.g. a column was added): reflect it again
+                    invalidate_tables(connection, table_name)
+                    conn.execute(insert(get_table(connection, table_name)).values(**row))
+                print(datetime.now(), 'Data written to database')
+            except IntegrityError as e:
+                # Check if it's a unique constraint violation
+                if ignore_unique_error and ("unique constraint" in str(e.orig).lower() or "duplicate key" in str(e.orig).lower()):
+                    # Silently ignore unique constraint violations
+                    print("Warning: entry already exists")
+                else:
+                    # Re-raise other integrity errors
+                    raise
+
+def upsert_to_database(connection: str, table_name: str, rows: dict | list[dict],
+                       conflict_columns: list[str] = None, update_columns: list[str] = None) -> dict:
+    """Insert one or more rows with INSERT ... ON CONFLICT (PostgreSQL and SQLite).
 
-        # Create & execute query
-        try:
-            query = insert(table).values(**row)
-            conn.execute(query)
-            print(datetime.now(), 'Data written to database')
-        except IntegrityError as e:
-            # Check if it's a unique constraint violation
-            if ignore_unique_error and ("unique constraint" in str(e.orig).lower() or "duplicate key" in str(e.orig).lower()):
-                # Silently ignore unique constraint violations
-                print("Warning: entry already exists")
+    Args:
+        rows: a row, or a list of rows that all have the same keys
+        conflict_columns: columns of the unique constraint to check; if None,
+            a conflict with any unique constraint skips the row
+        update_columns: if given, conflicting rows are updated with these columns
+            instead of skipped (requires conflict_columns)
+
+    Returns the number of rows "inserted", and "skipped" or "updated".
+    """
+    from sqlalchemy import func, literal_column, select
+    if isinstance(rows, dict):
+        rows = [rows]
+    existing = "updated" if update_columns else "skipped"
+    if not rows:
+        return {"inserted": 0, existing: 0}
+    if update_columns and not conflict_columns:
+        raise ValueError("update_columns requires conflict_columns")
+
+    engine = get_engine(connection)
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported for {dialect}")
+
+    table = get_table(connection, table_name)
+    query = insert(table)
+    if update_columns:
+        query = query.on_conflict_do_update(index_elements=conflict_columns,
+            set_={column: query.excluded[column] for column in update_columns})
+    else:
+        query = query.on_conflict_do_nothing(index_elements=conflict_columns)
+
+    with measure("db.upsert", table=table_name) as metric, engine.begin() as conn:
+        if not update_columns:
+            # Skipped rows are not returned
+            inserted = len(conn.execute(query.returning(literal_column("1")), rows).all())
+        elif dialect == "postgresql":
+            # xmax is 0 for rows that were inserted rather than updated
+            returned = conn.execute(query.returning(literal_column("xmax = 0")), rows).all()
+            inserted = sum(1 for (is_insert,) in returned if is_insert)
+        else:
+            # SQLite can't tell inserted and updated rows apart, so count the table
+            count = select(func.count()).select_from(table)
+            before = conn.execute(count).scalar_one()
+            conn.execute(query, rows)
+            inserted = conn.execute(count).scalar_one() - before
+        metric["rows"] = len(rows)
+    result = {"inserted": inserted, existing: len(rows) - inserted}
+    print(datetime.now(), f"Data written to database: {result}")
+    return result
+
+class _CsvChunks(io.TextIOBase):
+    """File-like object that renders a DataFrame as CSV one chunk at a time,
+        so COPY can stream it without the whole CSV in memory."""
+
+    def __init__(self, df: "pd.DataFrame", chunk_size: int):
+        self.chunks = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+        self.buffer = ""
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.position >= len(self.buffer):
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.buffer = chunk.to_csv(index=False, header=False, na_rep=COPY_NULL)
+                self.position = 0
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.position + size)
+            parts.append(self.buffer[self.position:end])
+            size -= 0 if size < 0 else end - self.position
+            self.position = end
+        return "".join(parts)
+
+def _prepare_dataframe(df: "pd.DataFrame", table: "Table") -> "pd.DataFrame":
+    """Check the columns against the table, and convert integer columns that
+        pandas stores as floats (because of missing values) back to integers."""
+    from sqlalchemy import Integer
+    unknown = [column for column in df.columns if column not in table.columns]
+    if unknown:
+        raise ValueError(f"Columns not in table {table.name}: {', '.join(map(str, unknown))}")
+    converted = {}
+    for column in df.columns:
+        if isinstance(table.columns[column].type, Integer) and df[column].dtype.kind == 'f':
+            converted[column] = df[column].astype("Int64")
+    return df.assign(**converted) if converted else df
+
+def _copy(conn, table_name: str, columns: list[str], df: "pd.DataFrame", chunk_size: int):
+    """COPY the DataFrame into a table, with psycopg2 or psycopg (3)."""
+    preparer = conn.dialect.identifier_preparer
+    column_list = ", ".join(preparer.quote(column) for column in columns)
+    statement = f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    reader = _CsvChunks(df, chunk_size)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):
+            cursor.copy_expert(statement, reader, size=COPY_BUFFER_SIZE)
+        else:
+            with cursor.copy(statement) as copy:
+                while data := reader.read(COPY_BUFFER_SIZE):
+                    copy.write(data)
+    finally:
+        cursor.close()
+
+def write_dataframe_to_database(connection: str, table_name: str, df: "pd.DataFrame",
+                                chunk_size: int = COPY_CHUNK_ROWS, ignore_duplicates: bool = False,
+                                conflict_columns: list[str] = None, update_columns: list[str] = None) -> dict:
+    """Append a DataFrame to a table, for backfills and bulk imports.
+
+    On PostgreSQL the rows are streamed with COPY, `chunk_size` rows at a time. With
+    `ignore_duplicates`, or `update_columns`, they are copied into a temporary table
+    first and merged with INSERT ... ON CONFLICT (see upsert_to_database).
+    Other databases use DataFrame.to_sql, or upsert_to_database per chunk.
+
+    Returns the number of rows "inserted", and "skipped" or "updated" when merging.
+    """
+    from sqlalchemy import inspect
+    engine = get_engine(connection)
+    merge = ignore_duplicates or bool(update_columns)
+    if update_columns and not conflict_columns:
+        raise ValueError("update_columns requires conflict_columns")
+    existing = "updated" if update_columns else "skipped"
+    if df.empty:
+        return {"inserted": 0, existing: 0} if merge else {"inserted": 0}
+
+    with measure("db.write_dataframe", table=table_name) as metric:
+        metric["rows"] = len(df)
+        driver_can_copy = engine.dialect.name == "postgresql" and engine.dialect.driver in ("psycopg2", "psycopg")
+        if not driver_can_copy or not inspect(engine).has_table(table_name):
+            # Without COPY, or if the table doesn't exist yet (to_sql creates it)
+            if merge:
+                result = {"inserted": 0, existing: 0}
+                for start in range(0, len(df), chunk_size):
+                    chunk = df.iloc[start:start + chunk_size]
+                    rows = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+                    for key, count in upsert_to_database(connection, table_name, rows,
+                                                         conflict_columns, update_columns).items():
+                        result[key] += count
             else:
-                # Re-raise other integrity errors
-                raise
+                df.to_sql(table_name, engine, if_exists='append', index=False, chunksize=chunk_size)
+                result = {"inserted": len(df)}
+        else:
+            result = _copy_dataframe(engine, get_table(connection, table_name), df, chunk_size,
+                                     merge, conflict_columns, update_columns)
+    print(datetime.now(), f"Data written to database: {result}")
+    return result
+
+def _copy_dataframe(engine: "Engine", table: "Table", df: "pd.DataFrame", chunk_size: int,
+                    merge: bool, conflict_columns: list[str], update_columns: list[str]) -> dict:
+    from sqlalchemy import column, literal_column, select, table as table_clause, text
+    from sqlalchemy.dialects.postgresql import insert
+    df = _prepare_dataframe(df, table)
+    columns = [str(name) for name in df.columns]
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        if not merge:
+            _copy(conn, preparer.format_table(table), columns, df, chunk_size)
+            return {"inserted": len(df)}
 
-def write_dataframe_to_database(connection: str, table_name: str, df: pd.DataFrame):
-    engine = create_engine(connection)
-    df.to_sql(table_name, engine, if_exists='append', index=False)
-    print(datetime.now(), 'Data written to database')
+        # Stage into a temporary table with the same columns, then merge
+        stage_name = f"stage_{table.name}"
+        conn.execute(text(f"CREATE TEMPORARY TABLE {preparer.quote(stage_name)} "
+                          f"(LIKE {preparer.format_table(table)} INCLUDING DEFAULTS) ON COMMIT DROP"))
+        _copy(conn, preparer.quote(stage_name), columns, df, chunk_size)
+        stage = table_clause(stage_name, *[column(name) for name in columns])
+        query = insert(table).from_select(columns, select(stage))
+        if update_columns:
+            query = query.on_conflict_do_update(index_elements=conflict_columns,
+                set_={name: query.excluded[name] for name in update_columns})
+        else:
+            query = query.on_conflict_do_nothing(index_elements=conflict_columns)
+        # xmax is 0 for rows that were inserted rather than updated
+        returned = conn.execute(query.returning(literal_column("xmax = 0"))).all()
+    inserted = sum(1 for (is_insert,) in returned if is_insert)
+    if update_columns:
+        return {"inserted": inserted, "updated": len(returned) - inserted}
+    return {"inserted": inserted, "skipped": len(df) - inserted}
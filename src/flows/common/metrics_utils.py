@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Metrics are buffered in memory and appended to a JSON-lines file in batches
+BATCH_SIZE = 100
+
+_buffer = []
+_buffer_lock = threading.Lock()
+
+
+def get_metrics_path() -> str:
+    path = os.getenv("DF_METRICS_FILE")
+    if path:
+        return path
+    from common.cache_utils import get_cache_dir
+    return os.path.join(get_cache_dir("metrics"), "metrics.jsonl")
+
+def record(operation: str, duration: float, outcome: str = "ok", bytes: int = None,
+           cache: str = None, **tags):
+    """Record one measurement.
+
+    Args:
+        operation: name of the operation, e.g. "http.fetch_json"
+        duration: in seconds
+        outcome: "ok", "error", or something more specific such as "timeout"
+        bytes: number of bytes transferred, if relevant
+        cache: "hit" or "miss", if the operation is cached
+        tags: other (JSON serializable) details, e.g. the host
+    """
+    metric = {
+        "time": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        "operation": operation,
+        "duration": round(duration, 6),
+        "outcome": outcome,
+    }
+    if bytes is not None:
+        metric["bytes"] = bytes
+    if cache is not None:
+        metric["cache"] = cache
+    metric.update(tags)
+    with _buffer_lock:
+        _buffer.append(metric)
+        full = len(_buffer) >= BATCH_SIZE
+    if full:
+        flush()
+
+@contextmanager
+def measure(operation: str, **tags):
+    """Measure the duration and outcome of a block of code. The yielded dict
+        can be used to add details, e.g. metric["bytes"] or metric["cache"].
+
+        with measure("db.write", table=table_name) as metric:
+            ...
+    """
+    metric = dict(tags)
+    start = time.perf_counter()
+    try:
+        yield metric
+    except BaseException:
+        metric.setdefault("outcome", "error")
+        raise
+    finally:
+        record(operation, time.perf_counter() - start, **{"outcome": "ok", **metric})
+
+def instrumented(operation: str = None):
+    """Decorator version of measure; the operation defaults to the function name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(operation or func.__qualname__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def flush():
+    with _buffer_lock:
+        if not _buffer:
+            return
+        batch = list(_buffer)
+        _buffer.clear()
+    try:
+        with open(get_metrics_path(), "a") as metrics_file:
+            metrics_file.write(''.join(json.dumps(metric, default=str) + '\n' for metric in batch))
+    except OSError as err:
+        print(f"Could not write metrics: {err}")
+
+atexit.register(flush)
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+def summarize(path: str = None, since: datetime = None) -> dict:
+    """Summary per operation: count, errors, p50/p95 duration (ms), bytes and cache hit rate."""
+    durations = {}
+    summary = {}
+    with open(path or get_metrics_path()) as metrics_file:
+        for line in metrics_file:
+            metric = json.loads(line)
+            if since is not None and datetime.fromisoformat(metric["time"]) < since:
+                continue
+            operation = metric["operation"]
+            stats = summary.setdefault(operation, {"count": 0, "errors": 0, "bytes": 0, "hits": 0, "misses": 0})
+            stats["count"] += 1
+            stats["errors"] += metric["outcome"] != "ok"
+            stats["bytes"] += metric.get("bytes", 0)
+            stats["hits"] += metric.get("cache") == "hit"
+            stats["misses"] += metric.get("cache") == "miss"
+            durations.setdefault(operation, []).append(metric["duration"])
+    for operation, stats in summary.items():
+        stats["p50_ms"] = round(1000 * percentile(durations[operation], 0.50), 1)
+        stats["p95_ms"] = round(1000 * percentile(durations[operation], 0.95), 1)
+    return dict(sorted(summary.items()))
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"{'operation':<40} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>10} {'hit rate':>8}")
+    for operation, stats in summarize(path).items():
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else ""
+        print(f"{operation:<40} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['bytes']:>10} {hit_rate:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
 import base64
-import requests
+from common.api_utils import post
 
 
 def send_notification(topic: str, title: str, message: str, priority: int = 3):
@@ -17,7 +17,7 @@ def send_notification(topic: str, title: str, message: str, priority: int = 3):
 
     host = os.getenv("NTFY_HOST")
     ntfy_url = f"{host}/{topic}"
-    response = requests.post(ntfy_url, data=message.encode("utf-8"), headers=headers)
+    response = post(ntfy_url, data=message.encode("utf-8"), headers=headers)
     
     if response.status_code != 200:
         print(f"Failed to send notification: {response.status_code} - {response.text}")
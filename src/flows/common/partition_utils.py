@@ -0,0 +1,117 @@
+import re
+from datetime import date, datetime, timezone
+
+# Monthly range partitions of a table are named <table>_pYYYYMM, e.g. p1_meter_p202610,
+# and cover [first of the month, first of the next month) in UTC. Other partitions
+# are a DEFAULT partition, and a converted table holding the rows before the first month.
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def get_partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month:%Y%m}"
+
+def _month_bounds(month: date) -> tuple[str, str]:
+    return f"{month:%Y-%m-%d} 00:00:00+00", f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00"
+
+def is_partitioned(conn, table_name: str) -> bool:
+    from sqlalchemy import text
+    return conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"),
+                        {"table": table_name}).scalar() is True
+
+def get_partitions(conn, table_name: str) -> dict[date, str]:
+    """The attached monthly partitions of a table (by month), ignoring other partitions."""
+    from sqlalchemy import text
+    names = conn.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                              "WHERE i.inhparent = to_regclass(:table)"), {"table": table_name}).scalars()
+    pattern = re.compile(re.escape(table_name) + r"_p(\d{4})(\d{2})$")
+    return {date(int(m[1]), int(m[2]), 1): name for name in names if (m := pattern.match(name))}
+
+def get_default_partition(conn, table_name: str) -> str | None:
+    from sqlalchemy import text
+    return conn.execute(text("SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partdefid "
+                             "WHERE p.partrelid = to_regclass(:table)"), {"table": table_name}).scalar()
+
+def get_ranges_end(conn, table_name: str) -> date | None:
+    """First month after the range partitions that are not monthly (e.g. a converted
+        table attached FROM (MINVALUE) TO the first month), if any."""
+    from sqlalchemy import text
+    monthly = set(get_partitions(conn, table_name).values())
+    bounds = conn.execute(text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                               "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)"),
+                          {"table": table_name}).all()
+    ends = [datetime.fromisoformat(m[1]).astimezone(timezone.utc).date()
+            for name, bound in bounds if name not in monthly and (m := re.search(r"TO \('([^']+)'\)", bound))]
+    return max(ends, default=None)
+
+def create_partitions(conn, table_name: str, first_month: date, last_month: date, column: str) -> list[str]:
+    """Create the missing monthly partitions from first_month up to and including last_month.
+        Indexes of the parent table, like the BRIN index, are created on them as well.
+        Rows of the month in the DEFAULT partition are moved to the new partition."""
+    from sqlalchemy import text
+    quote = conn.dialect.identifier_preparer.quote
+    existing = get_partitions(conn, table_name)
+    default = get_default_partition(conn, table_name)
+    created = []
+    month = first_month
+    while month <= last_month:
+        if month not in existing:
+            name = get_partition_name(table_name, month)
+            start, end = _month_bounds(month)
+            in_range = f"{quote(column)} >= '{start}' AND {quote(column)} < '{end}'"
+            if default and conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {quote(default)} WHERE {in_range})")).scalar():
+                # The new partition may not overlap rows in the default partition
+                conn.execute(text(f"CREATE TABLE {quote(name)} "
+                                  f"(LIKE {quote(table_name)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+                moved = conn.execute(text(f"WITH moved AS (DELETE FROM {quote(default)} WHERE {in_range} RETURNING *) "
+                                          f"INSERT INTO {quote(name)} SELECT * FROM moved")).rowcount
+                conn.execute(text(f"ALTER TABLE {quote(table_name)} ATTACH PARTITION {quote(name)} "
+                                  f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+                print(f"Moved {moved} rows from {default} to {name}")
+            else:
+                conn.execute(text(f"CREATE TABLE {quote(name)} PARTITION OF {quote(table_name)} "
+                                  f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+def detach_partitions(conn, table_name: str, before_month: date, drop: bool = False) -> list[str]:
+    """Detach the monthly partitions of months before before_month. The detached
+        tables keep their rows (unless drop), and can be attached again later."""
+    from sqlalchemy import text
+    quote = conn.dialect.identifier_preparer.quote
+    detached = []
+    for month, name in sorted(get_partitions(conn, table_name).items()):
+        if month >= before_month:
+            break
+        conn.execute(text(f"ALTER TABLE {quote(table_name)} DETACH PARTITION {quote(name)}"))
+        if drop:
+            conn.execute(text(f"DROP TABLE {quote(name)}"))
+        detached.append(name)
+    return detached
+
+def attach_partition(conn, table_name: str, month: date):
+    """Attach a previously detached monthly partition again."""
+    from sqlalchemy import text
+    quote = conn.dialect.identifier_preparer.quote
+    start, end = _month_bounds(month)
+    conn.execute(text(f"ALTER TABLE {quote(table_name)} ATTACH PARTITION {quote(get_partition_name(table_name, month))} "
+                      f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+
+def ensure_default_partition(conn, table_name: str):
+    """DEFAULT partition (<table>_default), so rows are still accepted when the
+        partition of their month is missing, e.g. if the maintenance has lapsed."""
+    from sqlalchemy import text
+    quote = conn.dialect.identifier_preparer.quote
+    if get_default_partition(conn, table_name) is None:
+        conn.execute(text(f"CREATE TABLE {quote(f'{table_name}_default')} PARTITION OF {quote(table_name)} DEFAULT"))
+
+def ensure_brin_index(conn, table_name: str, column: str):
+    """BRIN index on the time column: tiny, and enough for range scans of rows
+        that are inserted in time order. On a partitioned table it applies to all partitions."""
+    from sqlalchemy import text
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {quote(f'{table_name}_{column}_brin')} "
+                      f"ON {quote(table_name)} USING brin ({quote(column)})"))
@@ -0,0 +1,149 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from common.cache_utils import get_cache_dir
+
+# Capacity tariff: the average import power per quarter hour, and its peak per month
+QUARTER = timedelta(minutes=15)
+
+# Months follow the local time
+PEAK_TIMEZONE = ZoneInfo(os.getenv("HW_P1_TIMEZONE", "Europe/Amsterdam"))
+
+# Alert when the current quarter is on track to exceed the monthly peak (and this
+# minimum, as lower peaks are not billed), once it has run for ALERT_AFTER
+ALERT_MIN_KW = float(os.getenv("HW_P1_PEAK_ALERT_MIN_KW", "2.5"))
+ALERT_AFTER = timedelta(minutes=5)
+
+# The projection must exceed the peak by more than this, so a steady load at the
+# peak doesn't alert every quarter on floating point noise
+ALERT_TOLERANCE_KW = 0.001
+
+
+def floor_quarter(time: datetime) -> datetime:
+    return time - timedelta(minutes=time.minute % 15, seconds=time.second, microseconds=time.microsecond)
+
+def get_month(time: datetime) -> str:
+    return time.astimezone(PEAK_TIMEZONE).strftime("%Y-%m")
+
+
+class PeakTracker:
+    """Streaming quarter-hour average import power and monthly peak, from the
+        cumulative import counter (kWh) of successive readings. The state is a
+        handful of values, updated per reading; the counter at a quarter boundary
+        is interpolated between the readings around it.
+    """
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.quarter = datetime.fromisoformat(state["quarter"]) if state.get("quarter") else None
+        self.quarter_kwh = state.get("quarter_kwh")
+        # The first quarter starts at the first reading, rather than at its boundary
+        self.complete = state.get("complete", False)
+        self.last_time = datetime.fromisoformat(state["last_time"]) if state.get("last_time") else None
+        self.last_kwh = state.get("last_kwh")
+        self.month = state.get("month")
+        self.peak_kw = state.get("peak_kw", 0.0)
+        self.peak_quarter = state.get("peak_quarter")
+        self.alerted = state.get("alerted", False)
+
+    def to_dict(self) -> dict:
+        return {
+            "quarter": self.quarter.isoformat() if self.quarter else None,
+            "quarter_kwh": self.quarter_kwh,
+            "complete": self.complete,
+            "last_time": self.last_time.isoformat() if self.last_time else None,
+            "last_kwh": self.last_kwh,
+            "month": self.month,
+            "peak_kw": self.peak_kw,
+            "peak_quarter": self.peak_quarter,
+            "alerted": self.alerted,
+        }
+
+    def update(self, time: datetime, import_kwh: float) -> list[dict]:
+        """Add a reading. Returns the quarters that ended before it (usually none or one)."""
+        if self.last_time is not None and time <= self.last_time:
+            return []
+        if self.quarter is None:
+            self.quarter, self.quarter_kwh, self.complete = floor_quarter(time), import_kwh, False
+            self.last_time, self.last_kwh = time, import_kwh
+            return []
+
+        quarters = []
+        while time >= self.quarter + QUARTER:
+            end = self.quarter + QUARTER
+            fraction = (end - self.last_time) / (time - self.last_time)
+            end_kwh = self.last_kwh + fraction * (import_kwh - self.last_kwh)
+            quarters.append(self._close_quarter(end_kwh))
+            self.quarter, self.quarter_kwh, self.complete, self.alerted = end, end_kwh, True, False
+        self.last_time, self.last_kwh = time, import_kwh
+        return quarters
+
+    def _close_quarter(self, end_kwh: float) -> dict:
+        average_kw = max(end_kwh - self.quarter_kwh, 0) / (QUARTER / timedelta(hours=1))
+        month = get_month(self.quarter)
+        if month != self.month:
+            self.month, self.peak_kw, self.peak_quarter = month, 0.0, None
+        if self.complete and average_kw > self.peak_kw:
+            self.peak_kw, self.peak_quarter = average_kw, self.quarter.isoformat()
+        return {
+            "bucket": self.quarter,
+            "import_kwh": end_kwh - self.quarter_kwh,
+            "average_kw": average_kw,
+            "complete": self.complete,
+            "month_peak_kw": self.peak_kw,
+        }
+
+    def get_projection(self, active_power_w: float) -> float | None:
+        """Average of the current quarter (kW) if the current power continues until its end."""
+        if self.quarter is None or not self.complete:
+            return None
+        elapsed = self.last_time - self.quarter
+        energy_kwh = max(self.last_kwh - self.quarter_kwh, 0)
+        remaining_h = (QUARTER - elapsed) / timedelta(hours=1)
+        return (energy_kwh + max(active_power_w, 0) / 1000 * remaining_h) / (QUARTER / timedelta(hours=1))
+
+    def check_alert(self, active_power_w: float) -> float | None:
+        """The projected quarter average, if it is a new monthly peak that wasn't alerted yet."""
+        if self.alerted or self.last_time - self.quarter < ALERT_AFTER:
+            return None
+        projection = self.get_projection(active_power_w)
+        peak_kw = self.peak_kw if self.month == get_month(self.quarter) else 0.0
+        if projection is None or projection <= max(peak_kw, ALERT_MIN_KW) + ALERT_TOLERANCE_KW:
+            return None
+        self.alerted = True
+        return projection
+
+
+def get_state_path(name: str) -> str:
+    return os.path.join(get_cache_dir("peak"), f"{name}.json")
+
+def load_tracker(name: str) -> PeakTracker:
+    try:
+        with open(get_state_path(name)) as state_file:
+            return PeakTracker(json.load(state_file))
+    except FileNotFoundError:
+        return PeakTracker()
+    except (OSError, ValueError) as err:
+        logging.warning(f"Could not read peak state {name}, starting over: {err}")
+        return PeakTracker()
+
+def store_tracker(name: str, tracker: PeakTracker):
+    path = get_state_path(name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as state_file:
+        json.dump(tracker.to_dict(), state_file)
+    os.replace(tmp_path, path)
+
+def send_peak_alert(tracker: PeakTracker, projection: float):
+    """Notify (through ntfy, topic HW_P1_PEAK_TOPIC) that the quarter may set a new peak."""
+    from common.ntfy_utils import send_notification
+    quarter = tracker.quarter.astimezone(PEAK_TIMEZONE).strftime("%H:%M")
+    message = (f"Quarter {quarter} is on track for an average of {projection:.2f} kW, "
+               f"the monthly peak so far is {tracker.peak_kw:.2f} kW")
+    try:
+        send_notification(os.getenv("HW_P1_PEAK_TOPIC", "p1_peak"), "Capacity Peak Alert", message, priority=4)
+    except Exception as err:
+        # An alert is not worth failing the ingestion for
+        logging.error(f"Could not send peak alert: {err}")
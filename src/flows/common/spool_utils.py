@@ -0,0 +1,177 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from datetime import datetime
+from common.cache_utils import get_cache_dir
+from common.metrics_utils import measure
+
+# Readings are appended to a local SQLite database in WAL mode before they are
+# written to the database, so they survive an unreachable database (or a crash).
+# With synchronous=NORMAL the WAL is fsynced at checkpoints rather than on every
+# commit: an application crash loses nothing, a power cut at most the last commits.
+SPOOL_SYNCHRONOUS = "NORMAL"
+
+# Rows sent to the database per INSERT ... ON CONFLICT when draining
+DRAIN_BATCH_SIZE = 1000
+
+_drain_lock = threading.Lock()
+
+
+def get_spool_path() -> str:
+    return os.getenv("DF_SPOOL_FILE") or os.path.join(get_cache_dir("spool"), "spool.sqlite")
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or get_spool_path(), timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SPOOL_SYNCHRONOUS}")
+    conn.execute("""CREATE TABLE IF NOT EXISTS spool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row BLOB NOT NULL,
+        created REAL NOT NULL)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS spool_quarantine (
+        id INTEGER PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        row BLOB NOT NULL,
+        created REAL NOT NULL,
+        error TEXT NOT NULL,
+        quarantined REAL NOT NULL)""")
+    return conn
+
+def spool_rows(table_name: str, rows: dict | list[dict], path: str = None):
+    """Append rows for a table to the spool, in one transaction.
+        Each row should contain its own timestamp key (e.g. created_at), so
+        it is stored with the time it was measured, not when it was drained."""
+    if isinstance(rows, dict):
+        rows = [rows]
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO spool (table_name, row, created) VALUES (?, ?, ?)",
+                [(table_name, pickle.dumps(row), time.time()) for row in rows])
+    finally:
+        conn.close()
+
+def get_spool_size(path: str = None) -> dict:
+    """Number of spooled rows per table."""
+    conn = _connect(path)
+    try:
+        return dict(conn.execute("SELECT table_name, count(*) FROM spool GROUP BY table_name").fetchall())
+    finally:
+        conn.close()
+
+def get_quarantine_size(path: str = None) -> dict:
+    """Number of quarantined rows per table."""
+    conn = _connect(path)
+    try:
+        return dict(conn.execute("SELECT table_name, count(*) FROM spool_quarantine GROUP BY table_name").fetchall())
+    finally:
+        conn.close()
+
+def requeue_quarantine(table_name: str = None, path: str = None) -> int:
+    """Move quarantined rows (of one table, or all) back to the spool, e.g. after
+        creating a missing table. Returns the number of rows moved."""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            condition, params = ("WHERE table_name = ?", (table_name,)) if table_name else ("", ())
+            moved = conn.execute("INSERT INTO spool (id, table_name, row, created) "
+                f"SELECT id, table_name, row, created FROM spool_quarantine {condition}", params).rowcount
+            conn.execute(f"DELETE FROM spool_quarantine {condition}", params)
+        return moved
+    finally:
+        conn.close()
+
+def _quarantine(conn: sqlite3.Connection, table_name: str, batch: list[tuple], error: Exception):
+    """Move rows that the database rejects out of the spool, so they don't block the rows after them."""
+    print(datetime.now(), f"Quarantined {len(batch)} rows for {table_name}: {error}")
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO spool_quarantine (id, table_name, row, created, error, quarantined) "
+            "SELECT id, table_name, row, created, ?, ? FROM spool WHERE id = ?",
+            [(str(error), time.time(), spool_id) for spool_id, _ in batch])
+        conn.executemany("DELETE FROM spool WHERE id = ?", [(spool_id,) for spool_id, _ in batch])
+
+def drain_spool(connection: str, path: str = None, batch_size: int = DRAIN_BATCH_SIZE) -> dict:
+    """Replay the spool into the database, in order, in batches.
+
+    Rows are inserted with ON CONFLICT DO NOTHING and only then removed from the spool.
+    If the drain is interrupted in between, the replayed rows conflict with their
+    timestamp key (the primary key or a unique constraint of the table) and are
+    skipped, so each row is written exactly once.
+
+    Rows that the database rejects (e.g. a missing table or a constraint violation)
+    are moved to the quarantine table of the spool (see requeue_quarantine), so they
+    don't hold up the other rows and tables.
+
+    Returns the number of rows inserted, skipped and quarantined per table. If the
+    database is unreachable, the rows stay in the spool for the next drain.
+    """
+    from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+    from common.database_utils import upsert_to_database
+    result = {}
+    with _drain_lock, measure("spool.drain") as metric:
+        conn = _connect(path)
+        try:
+            # Tables are independent: each is drained in order, in its own batches
+            tables = [name for (name,) in conn.execute(
+                "SELECT table_name FROM spool GROUP BY table_name ORDER BY min(id)")]
+            for table_name in tables:
+                totals = result.setdefault(table_name, {"inserted": 0, "skipped": 0, "quarantined": 0})
+                while batch := conn.execute("SELECT id, row FROM spool WHERE table_name = ? ORDER BY id LIMIT ?",
+                                            (table_name, batch_size)).fetchall():
+                    # Rows with the same columns form a single INSERT
+                    entries, rows = [], []
+                    for spool_id, data in batch:
+                        row = pickle.loads(data)
+                        if rows and row.keys() != rows[0].keys():
+                            break
+                        entries.append((spool_id, data))
+                        rows.append(row)
+                    try:
+                        try:
+                            parts = [(entries, upsert_to_database(connection, table_name, rows))]
+                        except (OperationalError, InterfaceError):
+                            raise
+                        except DBAPIError:
+                            if len(rows) == 1:
+                                raise
+                            # One or more rows were rejected: write them one at a time
+                            parts = []
+                            for entry, row in zip(entries, rows):
+                                try:
+                                    parts.append(([entry], upsert_to_database(connection, table_name, row)))
+                                except (OperationalError, InterfaceError):
+                                    raise
+                                except Exception as err:
+                                    _quarantine(conn, table_name, [entry], err)
+                                    totals["quarantined"] += 1
+                    except (OperationalError, InterfaceError) as err:
+                        print(datetime.now(), f"Database unreachable, rows stay spooled: {err.orig}")
+                        metric["outcome"] = "unreachable"
+                        return result
+                    except Exception as err:
+                        # Rejected regardless of their values, e.g. the table doesn't exist
+                        _quarantine(conn, table_name, entries, err)
+                        totals["quarantined"] += len(entries)
+                        continue
+                    with conn:
+                        conn.execute("BEGIN")
+                        conn.executemany("DELETE FROM spool WHERE id = ?",
+                            [(spool_id,) for written, _ in parts for spool_id, _ in written])
+                    for _, counts in parts:
+                        for key, count in counts.items():
+                            totals[key] += count
+        finally:
+            metric["rows"] = sum(sum(totals.values()) for totals in result.values())
+            conn.close()
+    return result
+
+def write_to_database_spooled(connection: str, table_name: str, rows: dict | list[dict]) -> dict:
+    """Spool the rows, then drain the spool (including rows of earlier runs)."""
+    spool_rows(table_name, rows)
+    return drain_spool(connection)
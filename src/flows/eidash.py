@@ -1,7 +1,15 @@
 
+import argparse
+import contextvars
 import functools
+import json
 import logging
+import os
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -10,67 +18,163 @@ from prefect import flow, task
 from datetime import datetime
 from PIL import Image
 
-from nightscout import get_nightscout_data
-from weerlive import fetch_current_weerlive_data
-from common.ephem_utils import get_ephem_data
-from birthday_notify import get_todays_birthdays
-from sunspot_number import get_sunspot_number
-from sunspot_image import get_sunspot_image
-from kpindex_notify import get_kp_index
-from buienradar import fetch_and_process_buienradar_data
-from knmi_data import fetch_knmi_warnings
+from common.cache_utils import load_value, store_value
+from common.metrics_utils import record, measure, flush
 
 from eidash.draw.hkdraw import HKDraw
 from eidash.esp32_client import send_image
 
 
+# Default time (in seconds, counted from the start of fetching) a source
+# gets before the frame is drawn without it
+DEFAULT_DEADLINE = 30
+
+# Default maximum age (in seconds) of a last known good value that is
+# still drawn in place of a failed source
+DEFAULT_MAX_STALE = 3 * 60 * 60
+
 @task
 def fetch_data() -> dict:
+    # The sources are imported here, so runs in standby don't load them
+    # (and their dependencies, such as OpenCV and SQLAlchemy)
+    from nightscout import get_nightscout_data, age_nightscout_data
+    from weerlive import fetch_current_weerlive_data
+    from common.ephem_utils import get_ephem_data
+    from birthday_notify import get_todays_birthdays
+    from sunspot_number import get_sunspot_number
+    from sunspot_image import get_sunspot_image
+    from kpindex_notify import get_kp_index
+    from buienradar import fetch_and_process_buienradar_data
+    from knmi_data import fetch_knmi_warnings
 
     # Prepare to collect all data fetching calls to execute (later, with proper error handling)
     data_calls = []
-    def add_call(key, func, *args, **kwargs):
+    # age_stale(value, age) updates the time-relative fields of a stale value
+    def add_call(key, func, *args, deadline=DEFAULT_DEADLINE, max_stale=DEFAULT_MAX_STALE,
+                 revalidate_in_background=False, age_stale=None, **kwargs):
         data_calls.append({
-            "key": key, "name": func.__name__, "call": functools.partial(func, *args, **kwargs)
+            "key": key, "name": func.__name__, "deadline": deadline,
+            "max_stale": max_stale, "revalidate_in_background": revalidate_in_background,
+            "age_stale": age_stale, "call": functools.partial(func, *args, **kwargs)
         })
 
     # Add the calls
-    add_call("nightscout", get_nightscout_data)
+    add_call("nightscout", get_nightscout_data, max_stale=30 * 60, age_stale=age_nightscout_data)
     add_call("weather", fetch_current_weerlive_data)
     add_call("knmi_warnings", fetch_knmi_warnings)
-    add_call("ephem", get_ephem_data)
-    add_call("birthdays", get_todays_birthdays)
-    add_call("sunspot_image", get_sunspot_image)
-    add_call("sunspot_number", get_sunspot_number)
+    add_call("ephem", get_ephem_data, deadline=10)
+    add_call("birthdays", get_todays_birthdays, max_stale=60 * 60)
+    add_call("sunspot_image", get_sunspot_image, deadline=60, max_stale=24 * 60 * 60,
+             revalidate_in_background=True)
+    add_call("sunspot_number", get_sunspot_number, max_stale=24 * 60 * 60,
+             revalidate_in_background=True)
     add_call("kp_data", get_kp_index)
-    add_call("buienradar_text", fetch_and_process_buienradar_data)
-    
-    # Execute all data fetching calls with error handling
+    add_call("buienradar_text", fetch_and_process_buienradar_data, max_stale=30 * 60)
+
+    with measure("eidash.fetch_data"):
+        return execute_calls(data_calls)
+
+def execute_calls(data_calls: list[dict]) -> dict:
+    """Execute all data fetching calls concurrently, each with its own deadline.
+        Every successful result is stored as the source's last known good value.
+        A source that raises or misses its deadline is replaced by that value
+        if it is recent enough, or gets an error entry otherwise, so the frame
+        can still be drawn. The age of stale values is returned under the
+        "stale" key and the wall time per source under the "timings" key.
+    """
     collected_data = {}
+    stale = {}
+    durations = {}
+
+    def timed_call(call):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = call["call"]()   # Execute the functools.partial
+            store_value(call["key"], result)
+            outcome = "ok"
+            return result
+        finally:
+            durations[call["key"]] = time.perf_counter() - start
+            record(f"eidash.fetch.{call['key']}", durations[call["key"]], outcome)
+
+    def use_last_known_good(call) -> bool:
+        cached = load_value(call["key"], call["max_stale"])
+        record("eidash.last_known_good", 0.0, cache="miss" if cached is None else "hit", source=call["key"])
+        if cached is None:
+            return False
+        value, age = cached
+        if call.get("age_stale"):
+            value = call["age_stale"](value, age)
+        collected_data[call["key"]], stale[call["key"]] = value, age
+        logging.info(f"Using last known good {call['key']} ({stale[call['key']]:.0f}s old)")
+        return True
+
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(data_calls), thread_name_prefix="fetch_data")
+    futures = []
     for call in data_calls:
-        logging.info("CALLING " +call["name"])
+        logging.info("CALLING " + call["name"])
+        # Each thread gets a copy of the current context, so Prefect tasks
+        # and flows called from it are tracked as part of this run
+        context = contextvars.copy_context()
+        futures.append(executor.submit(context.run, timed_call, call))
+
+    for call, future in zip(data_calls, futures):
+        # Serve the stored value right away and let the fetch refresh it
+        # in the background, for use by the next run
+        if call["revalidate_in_background"] and not future.done() and use_last_known_good(call):
+            continue
+
+        remaining = max(0.0, start + call["deadline"] - time.monotonic())
+        wait([future], timeout=remaining)
+        if not future.done():
+            logging.error(f"{call['name']} missed its deadline of {call['deadline']}s")
+            durations.setdefault(call["key"], time.monotonic() - start)
+            if not use_last_known_good(call):
+                collected_data[call["key"]] = {
+                    "error": f"Timed out after {call['deadline']}s"
+                }
+            continue
         try:
-            collected_data[call["key"]] = call["call"]()   # Execute the functools.partial
+            collected_data[call["key"]] = future.result()
         except Exception as err:
-            collected_data[call["key"]] = {
-                "error": str(err)
-            }
             print(traceback.format_exc())
+            if not use_last_known_good(call):
+                collected_data[call["key"]] = {
+                    "error": str(err)
+                }
+
+    # Don't wait for sources that missed their deadline or are revalidating;
+    # their HTTP timeouts will end them eventually
+    executor.shutdown(wait=False, cancel_futures=True)
 
+    timings = dict(sorted(dict(durations).items(), key=lambda item: item[1], reverse=True))
+    for key, duration in timings.items():
+        logging.info(f"FETCHED {key} in {duration:.2f}s")
+    collected_data["timings"] = timings
+    collected_data["stale"] = stale
     return collected_data
 
-@task
-def draw_data(data: dict) -> Image.Image:
-    hkdraw = HKDraw(width=800, height=480, font_dir='src/flows/eidash/fonts')
+def create_hkdraw() -> HKDraw:
+    return HKDraw(width=800, height=480, font_dir='src/flows/eidash/fonts')
+
+def render_image(hkdraw: HKDraw, data: dict) -> Image.Image:
     if data is None:
         hkdraw.clear_image()
     else:
         hkdraw.draw_data(data)
     return hkdraw.context.image
 
+@task
+def draw_data(data: dict) -> Image.Image:
+    with measure("eidash.draw_data"):
+        return render_image(create_hkdraw(), data)
+
 @task
 def send_image_task(image: Image.Image):
     send_image(image)
+    flush()
 
 def is_standby_time() -> bool:
     """Determine if the current time is within the standby period.
@@ -100,6 +204,94 @@ def eidash_workflow():
     send_image_task(image)
 
 
-if __name__ == "__main__":
-    eidash_workflow()
+class EidashDaemon:
+    """Long-running dashboard process that keeps fonts, tiles, HTTP connection
+        pools and the last frame in memory between refreshes. It refreshes on
+        its own schedule (aligned to the interval, like the cron schedule) and
+        when triggered over HTTP (POST /refresh), e.g. by the eidash_trigger flow.
+    """
+
+    def __init__(self, interval=300, host='127.0.0.1', port=8765):
+        self.interval = interval
+        self.hkdraw = create_hkdraw()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.last_result = None
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    def refresh(self) -> dict:
+        """Fetch, draw and send one frame. Refreshes never overlap."""
+        with self.lock:
+            start = time.monotonic()
+            try:
+                data = None if is_standby_time() else fetch_data.fn()
+                image = render_image(self.hkdraw, data)
+                success = send_image(image)
+                result = {"success": success, "redrawn": list(self.hkdraw.dirty)}
+            except Exception as err:
+                print(traceback.format_exc())
+                result = {"success": False, "error": str(err)}
+            result["duration"] = time.monotonic() - start
+            result["finished"] = datetime.now().isoformat()
+            logging.info(f"Refresh: {result}")
+            record("eidash.refresh", result["duration"], "ok" if result["success"] else "error")
+            flush()
+            self.last_result = result
+            return result
+
+    def run_schedule(self):
+        while not self.stop_event.is_set():
+            next_run = (time.time() // self.interval + 1) * self.interval
+            if self.stop_event.wait(next_run - time.time()):
+                break
+            self.refresh()
+
+    def run(self):
+        locale.setlocale(locale.LC_TIME, "nl_NL.utf8")
+        if self.interval > 0:
+            threading.Thread(target=self.run_schedule, daemon=True).start()
+        host, port = self.server.server_address[:2]
+        logging.info(f"Dashboard daemon listening on http://{host}:{port}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop_event.set()
 
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != '/refresh':
+                    self.send_error(404)
+                    return
+                self.send_json(daemon.refresh())
+
+            def do_GET(self):
+                if self.path != '/status':
+                    self.send_error(404)
+                    return
+                self.send_json(daemon.last_result or {})
+
+            def send_json(self, result):
+                body = json.dumps(result).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true', help="keep running and refresh on a schedule")
+    parser.add_argument('--interval', type=int, default=300, help="daemon refresh interval in seconds, 0 to only refresh when triggered")
+    parser.add_argument('--port', type=int, default=int(os.getenv("EIDASH_DAEMON_PORT", "8765")))
+    args = parser.parse_args()
+    if args.daemon:
+        logging.basicConfig(level=logging.INFO)
+        EidashDaemon(interval=args.interval, port=args.port).run()
+    else:
+        eidash_workflow()
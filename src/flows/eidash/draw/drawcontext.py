@@ -1,5 +1,6 @@
 from PIL import Image, ImageDraw
 from .image_text import ImageText
+from .layers import get_layer
 
 class DrawContext:
 
@@ -11,6 +12,8 @@ class DrawContext:
         self.image = Image.new('1', (width, height), self.white)
         self.draw = ImageDraw.Draw(self.image)
         self.image_text = ImageText(self.image, self.draw)
+        self.cache_layers = False
+        self.layer_cache_dir = None
 
     def textsize(self, text, font):
         """Helper function to get text dimensions using textbbox (replaces deprecated textsize)"""
@@ -20,6 +23,16 @@ class DrawContext:
     def clear_image(self):
         self.draw.rectangle((0, 0, self.width, self.height), fill=self.white)
 
+    def draw_static_layer(self, name, key, render):
+        """Draw black content that only depends on the key (and the fonts and locale).
+            With layer caching enabled, render(context) draws it once on a blank
+            context and its ink is pasted on later frames; otherwise it draws directly."""
+        if not self.cache_layers:
+            render(self)
+            return
+        layer = get_layer(self, name, key, render, self.layer_cache_dir)
+        self.image.paste(self.black, (0, 0, self.width, self.height), layer)
+
     def draw_centered_text(self, position, text, font, fill):
         bbox = self.draw.textbbox((0, 0), text, font=font)
         text_width = bbox[2] - bbox[0]
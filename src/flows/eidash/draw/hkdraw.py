@@ -1,10 +1,13 @@
 import os
 import logging
-import functools
 import traceback
-from PIL import Image, ImageDraw, ImageFont
+from datetime import datetime
 
+from common.cache_utils import get_cache_dir
+from common.metrics_utils import measure
 from .drawcontext import DrawContext
+from .image_text import get_font
+from .tiles import get_tile_key, make_tile, load_tile, store_tile, get_previous_box
 from .date_time import *
 from .moonphase import *
 from .nightscout import *
@@ -13,24 +16,58 @@ from .birthdays import *
 from .sunspots import draw_sunspot_number, draw_sunspot_image, draw_kp_index
 from .buienradar import draw_buienradar_chart
 from .planets import draw_planets
+from .stale import draw_stale_age
 
 
 class HKDraw:
 
     def __init__(self, width, height, font_dir='fonts'):
         self.context = DrawContext(width, height)
-        self.context.font_normal = ImageFont.truetype(os.environ['EI_FONT'], size=30)
-        self.context.font_small = ImageFont.truetype(os.environ['EI_FONT'], size=18)
+        self.context.font_normal = get_font(os.environ['EI_FONT'], 30)
+        self.context.font_small = get_font(os.environ['EI_FONT'], 18)
         self.context.font_time = self.context.font_normal
-        self.context.font_weather_icons = ImageFont.truetype(os.path.join(font_dir, 'weather-iconic.ttf'), size=80)
-        self.context.font_icons_small = ImageFont.truetype(os.path.join(font_dir, 'weather-iconic.ttf'), size=40)
+        self.context.font_weather_icons = get_font(os.path.join(font_dir, 'weather-iconic.ttf'), 80)
+        self.context.font_icons_small = get_font(os.path.join(font_dir, 'weather-iconic.ttf'), 40)
+        self.context.cache_layers = True
+        self.context.layer_cache_dir = get_cache_dir("eidash", "layers")
+        self.tile_cache_dir = get_cache_dir("eidash", "tiles")
+        # Widgets redrawn (or removed) by the last draw_data call, with the box they changed
+        self.dirty = {}
+        # Tiles in the last frame, with their box
+        self.frame_tiles = None
 
     def clear_image(self):
         self.context.draw.rectangle((0, 0, self.context.width, 
             self.context.height), fill=self.context.white)
 
-    def draw_error(self, message, x, y):
-        self.context.draw.text((x, y), f"Error: {message}", font=self.context.font_small, fill=self.context.black)
+    def draw_error(self, message, x, y, context=None):
+        context = context or self.context
+        context.draw.text((x, y), f"Error: {message}", font=context.font_small, fill=context.black)
+
+    def new_tile_context(self):
+        """Blank context with the same size, fonts and settings as the main context."""
+        tile_context = DrawContext(self.context.width, self.context.height)
+        for attr, value in vars(self.context).items():
+            if attr.startswith('font_') or attr in ('cache_layers', 'layer_cache_dir'):
+                setattr(tile_context, attr, value)
+        return tile_context
+
+    def draw_tile(self, call):
+        tile_context = self.new_tile_context()
+        try:
+            if call["data"] is None:
+                # Data was not fetched to begin with
+                self.draw_error("No data", call["x"], call["y"], tile_context)
+            elif "error" in call["data"]:
+                # Error in data fetching
+                self.draw_error(call["data"]["error"], call["x"], call["y"], tile_context)
+            else:
+                call["func"](tile_context, call["data"], call["x"], call["y"], *call["args"], **call["kwargs"])
+        except Exception as err:
+            # Error during drawing
+            self.draw_error(str(err), call["x"], call["y"], tile_context)
+            print(traceback.format_exc())
+        return tile_context.image
 
     def draw_data(self, data):
         context = self.context
@@ -39,17 +76,24 @@ class HKDraw:
         # Clear
         self.clear_image()
 
-        # Collect all draw calls to execute later
+        # Collect all draw calls to execute later.
+        # Each widget is drawn on its own tile, which is only redrawn when
+        # its inputs change; depends_on lists inputs other than the data,
+        # such as the current time.
+        now = datetime.now()
         draw_calls = []
-        def add_call(func, context, data, x, y, *args, **kwargs):
+        # source is the data key of the widget, stale_at where its age is shown if it's stale
+        def add_call(func, context, data, x, y, *args, depends_on=None, source=None, stale_at=None,
+                     name=None, **kwargs):
             draw_calls.append({
-                "name": func.__name__, "context": context, "data": data, "x": x, "y": y,
-                "call": functools.partial(func, context, data, x, y, *args, **kwargs)
+                "name": name or func.__name__, "func": func, "data": data, "x": x, "y": y,
+                "args": args, "kwargs": kwargs, "depends_on": depends_on, "source": source,
+                "stale_at": stale_at or (x, y)
             })
 
         # Date & time
-        add_call(draw_date, context, {}, 10, 4)
-        add_call(draw_time, context, {}, self.context.width - 4, 4)
+        add_call(draw_date, context, {}, 10, 4, depends_on=now.date())
+        add_call(draw_time, context, {}, self.context.width - 4, 4, depends_on=now.strftime("%H:%M"))
         
         # Weather
         y1 = 60
@@ -59,53 +103,89 @@ class HKDraw:
         warningData = data.get("knmi_warnings", None)
         if weatherData is not None:
             weatherData["warning"] = warningData
-        add_call(draw_current, context, weatherData, x1, y1, w1, 80)
+        add_call(draw_current, context, weatherData, x1, y1, w1, 80, source="weather")
         add_call(draw_temp, context, weatherData, x1+w1, y1, w1, 64)
         add_call(draw_wind, context, weatherData, x1+2*w1, y1, w1, 80, 28)
         add_call(draw_atmos, context, weatherData, 10, 250, w1, 64)
         isWarningActive = weatherData is not None and weatherData.get("alarm") == "1"
         forecast_x = 90
         forecast_text_y = 150 if isWarningActive else y1 + 110
-        add_call(draw_forecast_table, context, weatherData, forecast_x, y1 + 110, 100, 30)
+        add_call(draw_forecast_table, context, weatherData, forecast_x, y1 + 110, 100, 30, depends_on=now.date())
         add_call(draw_forecast, context, weatherData, forecast_x + 400, forecast_text_y, 300, 0)
         if isWarningActive:
             add_call(draw_warning_symbol, context, {}, x1+3*w1, y1, 28, 6)
 
         # Buienradar
         buienradar_data = data.get("buienradar_text", None)
-        add_call(draw_buienradar_chart, context, buienradar_data, 10, 170, 74, 74)
+        add_call(draw_buienradar_chart, context, buienradar_data, 10, 170, 74, 74, source="buienradar_text")
 
         # Moon phase and planets
         ephemData = data.get("ephem", None)
-        add_call(draw_moon_phase, context, ephemData, 748, 80, 32)
+        add_call(draw_moon_phase, context, ephemData, 748, 80, 32, source="ephem")
         add_call(draw_planets, context, ephemData, 10, 330, 600, 130)
 
         # Sunspots
-        add_call(draw_sunspot_image, context, data.get("sunspot_image", None), 10, 80-36, 72, 72)
-        add_call(draw_sunspot_number, context, data.get("sunspot_number", None), 10, 120, 72, 20)
-        add_call(draw_kp_index, context, data.get("kp_data", None), 10, 140, 140, 20)
+        add_call(draw_sunspot_image, context, data.get("sunspot_image", None), 10, 80-36, 72, 72,
+                 source="sunspot_image")
+        add_call(draw_sunspot_number, context, data.get("sunspot_number", None), 10, 120, 72, 20,
+                 source="sunspot_number")
+        add_call(draw_kp_index, context, data.get("kp_data", None), 10, 140, 140, 20, source="kp_data")
 
         # Nightscout
         nightScoutData = data.get("nightscout", None)
-        add_call(draw_nightscout, context, nightScoutData, 650, self.context.height-36-10, 150, 36+10)
+        add_call(draw_nightscout, context, nightScoutData, 650, self.context.height-36-10, 150, 36+10,
+                 source="nightscout", stale_at=(628, self.context.height-36))
 
         # Birthdays
         birthdayData = data.get("birthdays", None)
-        add_call(draw_birthdays, context, birthdayData, 100, y1-20)
-
-        # Actually execute each draw call with proper error handling
+        add_call(draw_birthdays, context, birthdayData, 100, y1-20, depends_on=now.year, source="birthdays")
+
+        # Mark the widgets of sources that were served from their last known good
+        # value with its age (once per source, at the first widget)
+        stale = dict(data.get("stale") or {})
+        for call in list(draw_calls):
+            if call["source"] in stale:
+                add_call(draw_stale_age, context, {"age": stale.pop(call["source"]) // 60 * 60},
+                         *call["stale_at"], name=f"draw_stale_age_{call['source']}")
+
+        # Actually execute each draw call with proper error handling,
+        # reusing the tiles of widgets whose inputs did not change.
+        # Tiles are identified by the widget and its position among widgets of the same name,
+        # so a widget that comes and goes (the warning symbol) doesn't shift the others.
+        self.dirty = {}
+        frame_tiles = {}
+        occurrences = {}
         for call in draw_calls:
-            logging.info("DRAWING " + call["name"])
-            try:
-                if call["data"] is None:
-                    # Data was not fetched to begin with
-                    self.draw_error("No data", call["x"], call["y"])
-                elif "error" in call["data"]:
-                    # Error in data fetching
-                    self.draw_error(call["data"]["error"], call["x"], call["y"])
-                else:
-                    call["call"]()   # Execute the functools.partial
-            except Exception as err:
-                # Error during drawing
-                self.draw_error(str(err), call["x"], call["y"])
-                print(traceback.format_exc())
+            occurrence = occurrences[call["name"]] = occurrences.get(call["name"], -1) + 1
+            tile_id = f"{call['name']}_{occurrence}"
+            key = get_tile_key(context, call)
+            with measure(f"eidash.draw.{call['name']}") as metric:
+                tile = load_tile(tile_id, key, self.tile_cache_dir)
+                metric["cache"] = "miss" if tile is None else "hit"
+                if tile is None:
+                    logging.info("DRAWING " + call["name"])
+                    previous_box = get_previous_box(tile_id, self.tile_cache_dir)
+                    tile = make_tile(key, self.draw_tile(call))
+                    store_tile(tile_id, tile, self.tile_cache_dir)
+                    self.dirty[tile_id] = union_box(previous_box, tile["box"])
+                elif self.frame_tiles is not None and tile_id not in self.frame_tiles:
+                    # Reused, but not in the last frame
+                    self.dirty[tile_id] = tile["box"]
+            frame_tiles[tile_id] = tile["box"]
+
+            # Compose the frame from the ink of all tiles, in drawing order
+            if tile["mask"] is not None:
+                context.image.paste(context.black, tile["box"], tile["mask"])
+        # Widgets that were in the last frame, but not in this one
+        for tile_id, box in (self.frame_tiles or {}).items():
+            if tile_id not in frame_tiles:
+                self.dirty[tile_id] = box
+        self.frame_tiles = frame_tiles
+        logging.info(f"Redrawn widgets: {list(self.dirty)}")
+
+
+def union_box(box1, box2):
+    if box1 is None or box2 is None:
+        return box1 or box2
+    return (min(box1[0], box2[0]), min(box1[1], box2[1]),
+            max(box1[2], box2[2]), max(box1[3], box2[3]))
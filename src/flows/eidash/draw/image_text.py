@@ -6,15 +6,60 @@
 
 # Adapted from: https://gist.github.com/turicas/1455973
 
+import functools
 from PIL import ImageFont
 
 
+@functools.lru_cache(maxsize=None)
+def get_font(font_filename, font_size):
+    """Load a TrueType font, shared by all draw code in this process.
+        Fonts are immutable once loaded, so the same instance can be reused."""
+    return ImageFont.truetype(font_filename, size=font_size)
+
+
 def getsize(font, text):
     """Helper function to get text dimensions using getbbox (replaces deprecated getsize)"""
     bbox = font.getbbox(text)
     return (bbox[2] - bbox[0], bbox[3] - bbox[1])
 
 
+# Candidate lines whose estimated width is this close to the box width
+# (in pixels) are measured exactly
+WIDTH_TOLERANCE = 2
+
+
+@functools.lru_cache(maxsize=4096)
+def measure_word(font, word):
+    """Bounding box and advance width of a single word in the given font."""
+    return font.getbbox(word), font.getlength(word)
+
+
+def word_width(font, word):
+    bbox = measure_word(font, word)[0]
+    return bbox[2] - bbox[0]
+
+
+class TextLayout(object):
+    """Lines of text wrapped to a box width, as returned by ImageText.layout_text_box.
+        Can be drawn (repeatedly) with ImageText.draw_text_box."""
+
+    def __init__(self, font, box_width, lines, line_height):
+        self.font = font
+        self.box_width = box_width
+        self.lines = lines
+        self.line_height = line_height
+        self._line_widths = {}
+
+    @property
+    def size(self):
+        return (self.box_width, self.line_height * len(self.lines))
+
+    def line_width(self, index):
+        if index not in self._line_widths:
+            self._line_widths[index] = getsize(self.font, self.lines[index])[0]
+        return self._line_widths[index]
+
+
 class ImageText(object):
     def __init__(self, image, draw):
         self.image = image
@@ -22,20 +67,34 @@ class ImageText(object):
         self.size = self.image.size
 
     def get_font_size(self, text, font, max_width=None, max_height=None):
+        """Largest font size for which the text stays below max_width and max_height."""
         if max_width is None and max_height is None:
             raise ValueError('You need to pass max_width or max_height')
-        font_size = 1
-        text_size = self.get_text_size(font, font_size, text)
+
+        def too_big(font_size):
+            text_size = self.get_text_size(font, font_size, text)
+            return (max_width is not None and text_size[0] >= max_width) or \
+                   (max_height is not None and text_size[1] >= max_height)
+
+        text_size = self.get_text_size(font, 1, text)
         if (max_width is not None and text_size[0] > max_width) or \
            (max_height is not None and text_size[1] > max_height):
             raise ValueError("Text can't be filled in only (%dpx, %dpx)" % \
                     text_size)
-        while True:
-            if (max_width is not None and text_size[0] >= max_width) or \
-               (max_height is not None and text_size[1] >= max_height):
-                return font_size - 1
-            font_size += 1
-            text_size = self.get_text_size(font, font_size, text)
+        if too_big(1):
+            return 0
+        # Find an upper bound by doubling, then binary search between
+        # the largest size that fits (low) and the smallest that doesn't (high)
+        low, high = 1, 2
+        while not too_big(high):
+            low, high = high, 2 * high
+        while high - low > 1:
+            middle = (low + high) // 2
+            if too_big(middle):
+                high = middle
+            else:
+                low = middle
+        return low
 
     def write_text(self, xy, text, font_filename, font_size=11,
                    color=(0, 0, 0), max_width=None, max_height=None):
@@ -45,7 +104,7 @@ class ImageText(object):
             font_size = self.get_font_size(text, font_filename, max_width,
                                            max_height)
         text_size = self.get_text_size(font_filename, font_size, text)
-        font = ImageFont.truetype(font_filename, font_size)
+        font = get_font(font_filename, font_size)
         if x == 'center':
             x = (self.size[0] - text_size[0]) / 2
         if y == 'center':
@@ -54,43 +113,65 @@ class ImageText(object):
         return text_size
 
     def get_text_size(self, font_filename, font_size, text):
-        font = ImageFont.truetype(font_filename, font_size)
+        font = get_font(font_filename, font_size)
         return getsize(font, text)
 
-    def write_text_box(self, x, y, text, box_width, font,
-                       color=(0, 0, 0), align='left',
-                       justify_last_line=False):
-        text_height = 0
+    def layout_text_box(self, text, box_width, font):
+        """Wrap text into lines that fit box_width, measuring every word only once.
+
+        The width of a candidate line is computed from the cached advance widths
+        of its words. Only candidates within a few pixels of box_width are measured
+        exactly, so lines break exactly where measuring every candidate would.
+        """
+        space_length = measure_word(font, ' ')[1]
         lines = []
         line = []
-        words = text.split()
-        for word in words:
-            new_line = ' '.join(line + [word])
-            size = getsize(font, new_line)
-            text_height = size[1]
-            if size[0] <= box_width:
+        line_length = 0.0   # advance width of the current line, up to the next word
+        line_left = 0       # left bearing of the first word on the current line
+        candidate = ''
+        for word in text.split():
+            bbox, length = measure_word(font, word)
+            if line:
+                width = line_length + bbox[2] - line_left
+                if abs(width - box_width) <= WIDTH_TOLERANCE:
+                    width = getsize(font, ' '.join(line + [word]))[0]
+                candidate = line + [word]
+            else:
+                width = bbox[2] - bbox[0]
+                line_left = bbox[0]
+                candidate = [word]
+            if width <= box_width:
                 line.append(word)
+                line_length += length + space_length
             else:
                 lines.append(line)
                 line = [word]
+                line_length = length + space_length
+                line_left = bbox[0]
         if line:
             lines.append(line)
         lines = [' '.join(line) for line in lines if line]
+        # The height of the last candidate line is used for all lines
+        text_height = getsize(font, ' '.join(candidate))[1] if candidate else 0
+        return TextLayout(font, box_width, lines, text_height)
+
+    def draw_text_box(self, x, y, layout, color=(0, 0, 0), align='left',
+                      justify_last_line=False):
+        font = layout.font
+        box_width = layout.box_width
         line_y = y
-        for index, line in enumerate(lines):
+        for index, line in enumerate(layout.lines):
             if align == 'left':
                 self.draw.text((x, line_y), line, font=font, fill=color)
             elif align == 'right':
-                total_size = getsize(font, line)
-                x_left = x + box_width - total_size[0]
+                x_left = x + box_width - layout.line_width(index)
                 self.draw.text((x_left, line_y), line, font=font, fill=color)
             elif align == 'center':
-                total_size = getsize(font, line)
-                x_left = int(x + ((box_width - total_size[0]) / 2))
+                x_left = int(x + ((box_width - layout.line_width(index)) / 2))
                 self.draw.text((x_left, line_y), line, font=font, fill=color)
             elif align == 'justify':
                 words = line.split()
-                if (index == len(lines) - 1 and not justify_last_line) or \
+                if (index == len(layout.lines) - 1 and not justify_last_line) or \
                     len(words) == 1:
                     self.draw.text((x, line_y), line, font=font, fill=color)
                     continue
@@ -100,10 +181,15 @@ class ImageText(object):
                 word_x = x
                 for word in words[:-1]:
                     self.draw.text((word_x, line_y), word, font=font, fill=color)
-                    word_size = getsize(font, word)
-                    word_x += word_size[0] + space_width
-                last_word_size = getsize(font, words[-1])
-                last_word_x = x + box_width - last_word_size[0]
+                    word_x += word_width(font, word) + space_width
+                last_word_x = x + box_width - word_width(font, words[-1])
                 self.draw.text((last_word_x, line_y), words[-1], font=font, fill=color)
-            line_y += text_height
+            line_y += layout.line_height
         return (box_width, line_y - y)
+
+    def write_text_box(self, x, y, text, box_width, font,
+                       color=(0, 0, 0), align='left',
+                       justify_last_line=False):
+        layout = self.layout_text_box(text, box_width, font)
+        return self.draw_text_box(x, y, layout, color=color, align=align,
+                                  justify_last_line=justify_last_line)
@@ -0,0 +1,60 @@
+import os
+import locale
+import hashlib
+import logging
+import types
+from PIL import Image
+
+# Rendered layers, shared by all contexts in this process
+_layers = {}
+
+
+def get_code_hash(func) -> str | None:
+    """Hash of the code of a function (including functions defined in it), so
+        cached drawings are redrawn after the code that draws them changes."""
+    def code_parts(code):
+        return (code.co_code, code.co_names, tuple(
+            code_parts(const) if isinstance(const, types.CodeType) else repr(const) for const in code.co_consts))
+    code = getattr(func, '__code__', None)
+    return hashlib.sha256(repr(code_parts(code)).encode('utf-8')).hexdigest() if code else None
+
+
+def get_layer_key(context, name, key, render) -> str:
+    """Hash of everything a static layer depends on: its name and key (layout),
+        its render code, the frame size, the fonts of the context and the time locale."""
+    fonts = sorted((attr, getattr(font, 'path', None), getattr(font, 'size', None))
+                   for attr, font in vars(context).items() if attr.startswith('font_'))
+    parts = (name, key, get_code_hash(render), context.width, context.height, fonts,
+             locale.getlocale(locale.LC_TIME))
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def render_layer(context, render) -> Image.Image:
+    """Render a layer on a blank context with the same size and fonts,
+        and return its ink (the pixels drawn in black) as a 1-bit mask."""
+    from .drawcontext import DrawContext
+    layer_context = DrawContext(context.width, context.height)
+    for attr, value in vars(context).items():
+        if attr.startswith('font_'):
+            setattr(layer_context, attr, value)
+    render(layer_context)
+    return layer_context.image.point(lambda value: 255 if value == 0 else 0, mode='1')
+
+
+def get_layer(context, name, key, render, cache_dir=None) -> Image.Image:
+    layer_key = get_layer_key(context, name, key, render)
+    layer = _layers.get(layer_key)
+    if layer is not None:
+        return layer
+
+    path = os.path.join(cache_dir, f"{name}_{layer_key[:16]}.png") if cache_dir else None
+    if path and os.path.exists(path):
+        with Image.open(path) as layer_file:
+            layer = layer_file.convert('1')
+    else:
+        logging.info(f"Rendering static layer {name}")
+        layer = render_layer(context, render)
+        if path:
+            layer.save(path)
+    _layers[layer_key] = layer
+    return layer
@@ -1,5 +1,5 @@
 from draw.drawcontext import DrawContext
-from PIL import ImageFont
+from draw.image_text import get_font
 import os
 from .date_time import *
 from .nightscout import *
@@ -8,9 +8,9 @@ class NSDraw:
 
     def __init__(self, width, height):
         self.context = DrawContext(width, height)
-        self.context.font_normal = ImageFont.truetype(os.environ['NSDASH_FONT'], size=76)
-        self.context.font_small = ImageFont.truetype(os.environ['NSDASH_FONT'], size=28)
-        self.context.font_time = ImageFont.truetype(os.environ['NSDASH_FONT'], size=28)
+        self.context.font_normal = get_font(os.environ['NSDASH_FONT'], 76)
+        self.context.font_small = get_font(os.environ['NSDASH_FONT'], 28)
+        self.context.font_time = get_font(os.environ['NSDASH_FONT'], 28)
 
     def draw_data(self, data):
         context = self.context
@@ -5,10 +5,12 @@ from .moonphase import draw_moon_phase
 def draw_planets(context, data, x, y, w, h):
 
     # Background (for "below horizon")
-    n = 60
-    for k in range(n):
-        context.draw_bounded_line((x - h + k * ((w+h)/n), y + h), (x + k * ((w+h)/n), y), x, y-1, w, h+2)
-    
+    def draw_background(layer):
+        n = 60
+        for k in range(n):
+            layer.draw_bounded_line((x - h + k * ((w+h)/n), y + h), (x + k * ((w+h)/n), y), x, y-1, w, h+2)
+    context.draw_static_layer("planets_background", (x, y, w, h), draw_background)
+
     def equatorial_to_pixel(ra, dec):
         return (x+w - 1.0 * w * ra / 360, y+0.5*h - 0.5 * h * dec / 28)
 
@@ -42,15 +44,16 @@ def draw_planets(context, data, x, y, w, h):
             context.draw_bounded_line(p1, p2, x, y, w, h)
 
     # Outline (after horizon, to prevent erase)
-    context.draw.rectangle((x, y, x+w, y+h))
-
-    # Sun position over the year
-    positions = data["sun_positions"]
-    for i in range(len(positions) - 1):
-        i2 = i + 1
-        p1 = equatorial_to_pixel(positions[i][0], positions[i][1])
-        p2 = equatorial_to_pixel(positions[i2][0], positions[i2][1])
-        context.draw_dashed_line(p1[0], p1[1], p2[0], p2[1], 2)
+    # and sun position over the year
+    def draw_sun_path(layer):
+        layer.draw.rectangle((x, y, x+w, y+h))
+        positions = data["sun_positions"]
+        for i in range(len(positions) - 1):
+            i2 = i + 1
+            p1 = equatorial_to_pixel(positions[i][0], positions[i][1])
+            p2 = equatorial_to_pixel(positions[i2][0], positions[i2][1])
+            layer.draw_dashed_line(p1[0], p1[1], p2[0], p2[1], 2)
+    context.draw_static_layer("planets_sun_path", (x, y, w, h, data["sun_positions"]), draw_sun_path)
 
     # First compute label positions
     planet_points = []
@@ -78,11 +81,13 @@ def draw_planets(context, data, x, y, w, h):
         index += 1
 
     # Calendar lines
-    for i in range(5):
-        xc = x+w - 1.0 * w * i / 4
-        #context.draw.line((xc, y, xc, y + h))
-        context.draw_dashed_line(xc, y, xc, y + h, 20)
-        context.draw.text((xc - 10, y + h), ["mrt", "jun", "sep", "dec", "mrt"][i], font=context.font_small)
+    def draw_calendar(layer):
+        for i in range(5):
+            xc = x+w - 1.0 * w * i / 4
+            #layer.draw.line((xc, y, xc, y + h))
+            layer.draw_dashed_line(xc, y, xc, y + h, 20)
+            layer.draw.text((xc - 10, y + h), ["mrt", "jun", "sep", "dec", "mrt"][i], font=layer.font_small)
+    context.draw_static_layer("planets_calendar", (x, y, w, h), draw_calendar)
 
 
 def compute_label_positions(points, R=10.0, power=2):
@@ -0,0 +1,11 @@
+
+def format_age(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return f"{minutes}m" if minutes < 120 else f"{minutes // 60}h"
+
+def draw_stale_age(context, data, x, y):
+    """Mark a widget drawn from a last known good value with its age, e.g. "(25m)"."""
+    text = f"({format_age(data['age'])})"
+    text_dim = context.textsize(text, context.font_small)
+    context.draw.rectangle((x, y, x + text_dim[0] + 2, y + text_dim[1] + 2), fill=context.white)
+    context.draw.text((x + 1, y), text, font=context.font_small, fill=context.black)
@@ -0,0 +1,86 @@
+import os
+import json
+import locale
+import pickle
+import hashlib
+from PIL import Image
+from .layers import get_code_hash
+
+# Tiles drawn in this process, by tile id
+_tiles = {}
+
+
+def get_tile_key(context, call) -> str | None:
+    """Hash of everything a widget's tile depends on: the widget and its code, its data slice,
+        its geometry and other arguments, extra inputs such as the current time,
+        the fonts of the context and the time locale.
+        Returns None if the inputs can't be hashed (the tile is then always redrawn)."""
+    fonts = sorted((attr, getattr(font, 'path', None), getattr(font, 'size', None))
+                   for attr, font in vars(context).items() if attr.startswith('font_'))
+    parts = (call["name"], get_code_hash(call["func"]), call["data"], call["x"], call["y"], call["args"], call["kwargs"],
+             call["depends_on"], context.width, context.height, fonts,
+             locale.getlocale(locale.LC_TIME))
+    try:
+        return hashlib.sha256(pickle.dumps(parts)).hexdigest()
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+
+def make_tile(key, image) -> dict:
+    """Tile from a widget drawn on a blank context: the ink (the pixels drawn
+        in black) as a 1-bit mask, cropped to the box it covers."""
+    ink = image.point(lambda value: 255 if value == 0 else 0, mode='1')
+    box = ink.getbbox()
+    return {"key": key, "box": box, "mask": ink.crop(box) if box else None}
+
+
+def load_tile(tile_id, key, cache_dir=None) -> dict | None:
+    """Tile with the given id, if it was drawn for the same key."""
+    if key is None:
+        return None
+    tile = _tiles.get(tile_id)
+    if tile is not None:
+        return tile if tile["key"] == key else None
+    if cache_dir is None:
+        return None
+    path = os.path.join(cache_dir, tile_id)
+    try:
+        with open(path + ".json") as tile_file:
+            info = json.load(tile_file)
+        if info["key"] != key:
+            return None
+        mask = None
+        if info["box"] is not None:
+            with Image.open(path + ".png") as mask_file:
+                mask = mask_file.convert('1')
+    except (OSError, ValueError, KeyError):
+        return None
+    tile = {"key": key, "box": tuple(info["box"]) if info["box"] else None, "mask": mask}
+    _tiles[tile_id] = tile
+    return tile
+
+
+def get_previous_box(tile_id, cache_dir=None):
+    """Box covered by the tile last drawn with this id, if any."""
+    tile = _tiles.get(tile_id)
+    if tile is not None:
+        return tile["box"]
+    if cache_dir is None:
+        return None
+    try:
+        with open(os.path.join(cache_dir, tile_id + ".json")) as tile_file:
+            box = json.load(tile_file)["box"]
+        return tuple(box) if box else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_tile(tile_id, tile, cache_dir=None):
+    _tiles[tile_id] = tile
+    if cache_dir is None or tile["key"] is None:
+        return
+    path = os.path.join(cache_dir, tile_id)
+    if tile["mask"] is not None:
+        tile["mask"].save(path + ".png")
+    with open(path + ".json", "w") as tile_file:
+        json.dump({"key": tile["key"], "box": tile["box"]}, tile_file)
@@ -125,11 +125,16 @@ def draw_forecast_table(context, data, x, y, column_width, row_height):
     h = 5 * row_height
     now = datetime.now()
     
-    # Row headers
-    for i, text in enumerate(["", "Verw", "Temp", "Wind", "Zon/reg"]):
-        context.image_text.write_text_box(x, y + i * row_height, text,
-            box_width=column_width - 10, align='right', font=context.font_small,
-            color=context.black)
+    # Row headers and grid lines
+    def draw_grid(layer):
+        for i, text in enumerate(["", "Verw", "Temp", "Wind", "Zon/reg"]):
+            layer.image_text.write_text_box(x, y + i * row_height, text,
+                box_width=column_width - 10, align='right', font=layer.font_small,
+                color=layer.black)
+        for i in range(3):
+            line_x = x + (i+1) * column_width
+            layer.draw.line([(line_x, y), (line_x, y+h)])
+    context.draw_static_layer("forecast_table", (x, y, column_width, row_height), draw_grid)
 
     # To keep things clean
     def draw_cell(x, y, text, font=context.font_small):
@@ -138,9 +143,6 @@ def draw_forecast_table(context, data, x, y, column_width, row_height):
 
     # Columns per day
     for i in range(3):
-        line_x = x + (i+1) * column_width
-        draw.line([(line_x, y), (line_x, y+h)])
-        
         day = now + timedelta(days=i)
         day_text = day.strftime('%a')
         draw_cell(x + (i+1) * column_width, y, day_text)
@@ -1,75 +1,225 @@
 import requests
+from http.client import RemoteDisconnected
+from urllib3.exceptions import NewConnectionError, ProtocolError
 import os
+import time
+import hashlib
 import numpy as np
 import logging
+from common.api_utils import get
+from common.cache_utils import get_cache_dir
+from common.metrics_utils import record
 
-# This function is entirely courtesy of our ChatGPT overlords
-# (it can probably be done more efficient, but it works)
-def encode_bit_array(bits):
-    # Define the mapping from 4-bit strings to characters
-    char_map = {
-        '0000': 'a',
-        '0001': 'b',
-        '0010': 'c',
-        '0011': 'd',
-        '0100': 'e',
-        '0101': 'f',
-        '0110': 'g',
-        '0111': 'h',
-        '1000': 'i',
-        '1001': 'j',
-        '1010': 'k',
-        '1011': 'l',
-        '1100': 'm',
-        '1101': 'n',
-        '1110': 'o',
-        '1111': 'p'
-    }
-
-    # Convert the numpy array of bits to a binary string
-    bin_str = ''.join(['1' if bit else '0' for bit in bits])
-
-    # Break the binary string into groups of four characters each
-    groups = [bin_str[i:i+4] for i in range(0, len(bin_str), 4)]
-
-    # Map each group of four characters to the corresponding character
-    result = ''.join([char_map[group] for group in groups])
-
-    # Swap the position of every two characters
-    result = ''.join([result[i:i+2][::-1] for i in range(0, len(result), 2)])
+# Characters for each 4-bit value: 0000 -> 'a' ... 1111 -> 'p'
+NIBBLE_CHARS = np.frombuffer(b'abcdefghijklmnop', dtype=np.uint8)
+
+# For each byte value, the two characters the ESP32 expects: the characters
+# of both nibbles in swapped order (low nibble first)
+BYTE_CHARS = np.stack([NIBBLE_CHARS[np.arange(256) & 0x0F],
+                       NIBBLE_CHARS[np.arange(256) >> 4]], axis=1)
 
+def encode_bit_array(bits):
+    """Encode an array of bits as a string of 'a'..'p' characters, one per 4 bits,
+        with every two characters swapped (as expected by the ESP32).
+    """
+    bits = np.asarray(bits).reshape(-1)
+    if bits.shape[0] % 4 != 0:
+        raise ValueError("Number of bits must be a multiple of 4")
+    result = encode_packed(np.packbits(bits.astype(bool)))
+    if bits.shape[0] % 8 != 0:
+        # Trailing half byte: packbits padded it with a zero low nibble,
+        # which would be swapped in front of it
+        result = result[:-2] + result[-1]
     return result
 
-def make_request(path):
+def encode_packed(packed):
+    """Encode packed bits (bytes or a uint8 array, as returned by np.packbits)
+        in the format of encode_bit_array."""
+    packed = np.frombuffer(packed, dtype=np.uint8) if isinstance(packed, bytes) else packed
+    return BYTE_CHARS[packed].tobytes().decode('ascii')
+
+def pack_image(img) -> bytes:
+    return np.packbits(np.asarray(img).reshape(-1).astype(bool)).tobytes()
+
+# Data is sent in chunks of 1000 characters, representing 4000 bits (500 bytes)
+CHUNK_BYTES = 500
+
+# Resend an unchanged frame after this many seconds anyway, in case
+# the panel was reset in the meantime
+FORCE_REFRESH_SECONDS = 60 * 60
+
+def get_last_frame_path() -> str:
+    return os.path.join(get_cache_dir("eidash"), "last_frame.bin")
+
+def load_last_frame() -> tuple[bytes, str, float] | None:
+    """Load the last frame that was sent successfully.
+
+    Returns:
+        (packed bits, sha256 hash, age in seconds), or None if there is none.
+    """
+    path = get_last_frame_path()
+    hash_path = path + ".sha256"
+    if not os.path.exists(path) or not os.path.exists(hash_path):
+        return None
+    with open(path, "rb") as frame_file:
+        packed = frame_file.read()
+    with open(hash_path) as hash_file:
+        frame_hash = hash_file.read().strip()
+    return packed, frame_hash, time.time() - os.path.getmtime(path)
+
+def store_last_frame(packed: bytes):
+    path = get_last_frame_path()
+    with open(path + ".tmp", "wb") as frame_file:
+        frame_file.write(packed)
+    os.replace(path + ".tmp", path)
+    with open(path + ".sha256", "w") as hash_file:
+        hash_file.write(hashlib.sha256(packed).hexdigest())
+
+def get_changed_chunks(previous: bytes | None, current: bytes, chunk_bytes: int = CHUNK_BYTES) -> list[int]:
+    """Indices of the chunks of `current` that differ from `previous`.
+        All chunks are returned when there is no (comparable) previous frame."""
+    n_chunks = -(-len(current) // chunk_bytes)
+    if previous is None or len(previous) != len(current):
+        return list(range(n_chunks))
+    padding = n_chunks * chunk_bytes - len(current)
+    a = np.pad(np.frombuffer(previous, dtype=np.uint8), (0, padding))
+    b = np.pad(np.frombuffer(current, dtype=np.uint8), (0, padding))
+    changed = (a != b).reshape(n_chunks, chunk_bytes).any(axis=1)
+    return np.flatnonzero(changed).tolist()
+
+# Outcomes of a single request to the ESP32
+SENT = "sent"
+NOT_SENT = "not_sent"   # the request never reached the device, safe to retry
+FAILED = "failed"       # unknown whether the device processed the request
+
+# (connect, read) timeouts in seconds per request
+REQUEST_TIMEOUT = (3, 10)
+
+# Retries per request that did not reach the device, with exponential backoff
+MAX_RETRIES = 3
+RETRY_DELAY = 0.2
+MAX_RETRY_DELAY = 2.0
+
+# Number of times the upload is restarted from the beginning of the frame
+MAX_RESTARTS = 2
+
+# Total time in seconds an upload (including retries and restarts) may take
+UPLOAD_BUDGET_SECONDS = 60
+
+def make_request(path, timeout=REQUEST_TIMEOUT) -> str:
     # The "server" running on the ESP32 will not respond with a proper status code,
     # but will terminate the connection on every call, even when the command is
     # successful. We do want to impose and catch a timeout however.
     try:
-        requests.get(path, timeout=10)
-        return True
+        get(path, timeout=timeout)
+        return SENT
+    except requests.exceptions.ConnectTimeout as e:
+        logging.warning("ESP32 connection timed out")
+        return NOT_SENT
     except requests.exceptions.Timeout as e:
         logging.error("ESP32 request timed out")
-        return False  # Server not available
+        return FAILED
+    except requests.exceptions.ConnectionError as e:
+        error = e.args[0] if e.args else None
+        if isinstance(getattr(error, 'reason', None), NewConnectionError):
+            logging.warning("ESP32 connection refused")
+            return NOT_SENT
+        # The device closes the connection after reading the request (RemoteDisconnected);
+        # after a reset it is unknown whether the request was read
+        if isinstance(error, ProtocolError) and any(isinstance(arg, ConnectionResetError)
+                and not isinstance(arg, RemoteDisconnected) for arg in error.args):
+            logging.error("ESP32 connection reset")
+            return FAILED
+        return SENT   # We expect this
     except requests.exceptions.RequestException as e:
-        return True   # We expect this
+        return SENT   # We expect this
+
+def send_image(img, force=False) -> bool:
+    """Send the image to the ESP32, unless it is identical to the last frame
+        that was sent (and that frame is not too old).
+
+    Returns:
+        True if the frame is on the panel, False if sending failed.
+    """
+    packed = pack_image(img)
+    last_frame = load_last_frame()
+    if last_frame is not None and not force:
+        last_packed, last_hash, age = last_frame
+        if age < FORCE_REFRESH_SECONDS and last_hash == hashlib.sha256(packed).hexdigest():
+            logging.info("Frame unchanged, not sending")
+            record("esp32.upload", 0.0, cache="hit")
+            return True
+    changed_chunks = get_changed_chunks(last_frame[0] if last_frame else None, packed)
+    logging.info(f"{len(changed_chunks)} of {-(-len(packed) // CHUNK_BYTES)} chunks changed")
+
+    # The protocol only supports writing the whole frame, so all chunks are sent
+    stats = send_frame(packed)
+    logging.info(f"Upload stats: {stats}")
+    record("esp32.upload", stats["duration"], "ok" if stats["success"] else "error",
+           bytes=stats["bytes_sent"], cache="miss", retries=stats["retries"], restarts=stats["restarts"],
+           changed_chunks=len(changed_chunks))
+    if stats["success"]:
+        store_last_frame(packed)
+    return stats["success"]
+
+def send_frame(packed: bytes, budget=UPLOAD_BUDGET_SECONDS) -> dict:
+    """Upload a frame of packed bits to the ESP32.
 
-def send_image(img):
+    A request that did not reach the device is retried with backoff, resuming
+    at the same chunk. When it is unknown whether the device received a chunk
+    (a read timeout), resending it could duplicate it, so the upload restarts
+    from the beginning of the frame instead. Gives up when the time budget runs out.
+
+    Returns:
+        Upload stats: success, retries, restarts, bytes_sent and duration (seconds).
+    """
     host = os.environ['EI_ESP32_HOST']
     # The server on the ESP32 expects commands and data in the path of the request
-    
-    # Begin write
-    success = make_request(f"{host}/EPDw_")
-    if not success:
-        return  # Don't bother to continue
-    
-    # Write 1000 characters per request
-    bits = np.asarray(img).reshape(-1)
-    for i in range(0, bits.shape[0], 4000):
-        # Data is sent in chunks of 1000 characters, representing 4000 bits
-        line = encode_bit_array(bits[i:(i+4000)])
-        success = make_request(f"{host}/{line}iodaLOAD_")
-        if not success:
-            return  # Don't bother to continue
-
-    # Finalize
-    make_request(f"{host}/SHOW_")
+    encoded = encode_packed(packed)
+    chunks = [encoded[i:(i + 2 * CHUNK_BYTES)] for i in range(0, len(encoded), 2 * CHUNK_BYTES)]
+    stats = {"success": False, "retries": 0, "restarts": 0, "bytes_sent": 0, "duration": 0.0}
+    start = time.monotonic()
+    deadline = start + budget
+
+    def request_with_retry(path) -> bool:
+        delay = RETRY_DELAY
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt > 0:
+                if time.monotonic() + delay > deadline:
+                    return False
+                time.sleep(delay)
+                delay = min(2 * delay, MAX_RETRY_DELAY)
+                stats["retries"] += 1
+            result = make_request(path)
+            if result == SENT:
+                stats["bytes_sent"] += len(path)
+                return True
+            if result == FAILED:
+                return False
+        return False
+
+    for attempt in range(MAX_RESTARTS + 1):
+        if attempt > 0:
+            if time.monotonic() >= deadline:
+                break
+            stats["restarts"] += 1
+            logging.warning(f"Restarting upload, failed at chunk {offset} of {len(chunks)}")
+
+        # Begin write
+        offset = 0
+        if not request_with_retry(f"{host}/EPDw_"):
+            break  # Don't bother to continue
+
+        # Write 1000 characters per request
+        while offset < len(chunks) and request_with_retry(f"{host}/{chunks[offset]}iodaLOAD_"):
+            offset += 1
+        if offset < len(chunks):
+            continue
+
+        # Finalize
+        if request_with_retry(f"{host}/SHOW_"):
+            stats["success"] = True
+            break
+
+    stats["duration"] = time.monotonic() - start
+    return stats
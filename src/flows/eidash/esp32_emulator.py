@@ -0,0 +1,167 @@
+"""Local stand-in for the e-paper server running on the ESP32.
+
+Implements the same protocol as the device (see esp32_client.py):
+    /EPDw_             begin a new frame
+    /<data>iodaLOAD_   append encoded data to the frame
+    /SHOW_             show the frame (here: keep it and optionally save it as PNG)
+Like the device, it never sends a response but closes the connection on every request.
+Latency, dropped requests and timeouts can be injected to test the client. A dropped
+request's connection is reset as soon as it is accepted, so the client's connect usually
+fails as refused (not sent, retried). If the client already sent the request, it sees a
+reset and can't tell whether it was read (failed, the upload restarts).
+
+Usage: python src/flows/eidash/esp32_emulator.py --port 8080 --output frame.png
+"""
+import argparse
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+
+
+def decode_frame(encoded: str, width: int, height: int) -> Image.Image:
+    """Inverse of esp32_client.encode_bit_array for a complete frame."""
+    chars = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8) - ord('a')
+    packed = (chars[1::2] << 4) | chars[0::2]
+    bits = np.unpackbits(packed.astype(np.uint8))[:width * height]
+    return Image.fromarray(bits.reshape(height, width).astype(bool))
+
+
+class _Server(ThreadingHTTPServer):
+
+    def __init__(self, address, handler, emulator):
+        self.emulator = emulator
+        super().__init__(address, handler)
+
+    def verify_request(self, request, client_address) -> bool:
+        if not self.emulator.drop_connection():
+            return True
+        # Reset (rather than close) the connection right after accepting it, before
+        # the client gets to send the request (it can't be refused once accepted)
+        request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        request.close()
+        return False
+
+
+class ESP32Emulator:
+
+    def __init__(self, host='127.0.0.1', port=0, width=800, height=480, output_path=None,
+                 latency=0.0, drop_rate=0.0, timeout_rate=0.0, timeout_seconds=15.0, seed=None):
+        self.width = width
+        self.height = height
+        self.output_path = output_path
+        self.latency = latency                  # seconds added to every request
+        self.drop_rate = drop_rate              # fraction of connections reset when accepted
+        self.timeout_rate = timeout_rate        # fraction of requests that hang
+        self.timeout_seconds = timeout_seconds  # how long a hanging request hangs
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.frames = []
+        self.stats = {"requests": 0, "bytes": 0, "dropped": 0, "timeouts": 0,
+                      "frames": 0, "incomplete_frames": 0}
+        self.server = _Server((host, port), self._make_handler(), self)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def drop_connection(self) -> bool:
+        with self.lock:
+            if self.random.random() >= self.drop_rate:
+                return False
+            self.stats["requests"] += 1
+            self.stats["dropped"] += 1
+            return True
+
+    def handle_command(self, path: str):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(path)
+            fault = self.random.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if fault < self.timeout_rate:
+            with self.lock:
+                self.stats["timeouts"] += 1
+            time.sleep(self.timeout_seconds)
+            return
+
+        command = path.lstrip('/')
+        with self.lock:
+            if command == 'EPDw_':
+                self.buffer = []
+            elif command.endswith('iodaLOAD_'):
+                self.buffer.append(command[:-len('iodaLOAD_')])
+            elif command == 'SHOW_':
+                self.show()
+            else:
+                logging.warning(f"Unknown command: {command[:20]}")
+
+    def show(self):
+        encoded = ''.join(self.buffer)
+        if len(encoded) != self.width * self.height // 4:
+            self.stats["incomplete_frames"] += 1
+            logging.warning(f"Incomplete frame: {len(encoded)} characters")
+            return
+        image = decode_frame(encoded, self.width, self.height)
+        self.frames.append(image)
+        self.stats["frames"] += 1
+        if self.output_path:
+            image.save(self.output_path)
+
+    def _make_handler(self):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                emulator.handle_command(self.path)
+                # Like the device: no response, just close the connection
+                self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP32 e-paper server emulator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--output', default='esp32_frame.png', help="PNG file for the shown frame")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of connections reset when accepted")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument('--timeout-seconds', type=float, default=15.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = ESP32Emulator(args.host, args.port, output_path=args.output, latency=args.latency,
+        drop_rate=args.drop_rate, timeout_rate=args.timeout_rate, timeout_seconds=args.timeout_seconds)
+    print(f"ESP32 emulator listening on {emulator.url}")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(emulator.stats)
+
+if __name__ == "__main__":
+    main()
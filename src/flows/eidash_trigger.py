@@ -0,0 +1,27 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+from prefect import flow
+from common.api_utils import post
+
+# Lightweight entry point for when the dashboard runs as a daemon
+# (python src/flows/eidash.py --daemon --interval 0): the scheduled run
+# only asks the daemon to refresh, instead of importing and running
+# the whole dashboard workflow in a fresh process.
+
+@flow(name="E-Ink Dashboard trigger")
+def eidash_trigger() -> dict:
+    url = os.getenv("EIDASH_DAEMON_URL", "http://127.0.0.1:8765")
+    response = post(f"{url}/refresh", timeout=(5, 180))
+    if response.status_code != 200:
+        print(f"Failed to trigger refresh: {response.status_code} - {response.text}")
+        raise Exception("Failed to trigger refresh")
+    result = response.json()
+    print(result)
+    if not result.get("success"):
+        raise Exception(f"Dashboard refresh failed: {result}")
+    return result
+
+if __name__ == "__main__":
+    eidash_trigger()
@@ -5,7 +5,7 @@ from prefect import flow, task
 import os
 from datetime import datetime, timezone
 from common.api_utils import fetch_json
-from common.database_utils import write_to_database
+from common.spool_utils import write_to_database_spooled
 
 @task
 def get_enphase_data():
@@ -39,7 +39,7 @@ def process_data(data: dict) -> dict:
 def store_data(data):
     database_connection = os.getenv("DATABASE_CONNECTION")
     table_name = os.getenv("EN_DB_TABLE")
-    write_to_database(database_connection, table_name, data, ignore_unique_error=True)
+    write_to_database_spooled(database_connection, table_name, data)
 
 @flow(name="Enphase data ETL")
 def enphase_data_etl():
@@ -3,9 +3,9 @@ load_dotenv()
 
 from prefect import flow, task
 from prefect.cache_policies import TASK_SOURCE, INPUTS
-import os, requests
+import os
 from datetime import timedelta
-from common.api_utils import fetch_json
+from common.api_utils import fetch_json, get
 
 
 @task(
@@ -36,7 +36,7 @@ def get_file_download_url(file_listing: dict) -> str:
 @task(retries=3, retry_delay_seconds=5)
 def download_knmi_file(download_url: str) -> str:
     """Step 3: download the XML/TXT content."""
-    resp = requests.get(download_url, timeout=30)
+    resp = get(download_url)
     resp.raise_for_status()
     return resp.text
 
@@ -71,6 +71,12 @@ def extract_current_value(entries: list[dict]) -> dict:
         "date_string": last['dateString']
     }
 
+def age_nightscout_data(data: dict, age: float) -> dict:
+    """The data as it would have been fetched `age` seconds later (for a stale value)."""
+    if data["minutes_ago"] < 0:
+        return data
+    return {**data, "minutes_ago": data["minutes_ago"] + int(age // 60)}
+
 @flow(name="Nightscout data ETL")
 def get_nightscout_data() -> dict:
     entries = fetch_entries() # Fetch the latest entries, potentially from cache
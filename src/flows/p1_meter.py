@@ -3,41 +3,71 @@ load_dotenv()
 
 from prefect import flow, task
 import os
-from common.api_utils import fetch_json
-from common.database_utils import write_to_database
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+from datetime import datetime, timezone
+from common.api_utils import fetch_json, get
+from common.metrics_utils import record, flush as flush_metrics
+from common.peak_utils import PeakTracker, load_tracker, store_tracker, send_peak_alert
+from common.spool_utils import spool_rows, write_to_database_spooled
+
+# The keys that we want, besides the time of the reading (created_at)
+P1_KEYS = [
+    'active_tariff',
+    'total_power_import_kwh',
+    'total_power_import_t1_kwh',
+    'total_power_import_t2_kwh',
+    'total_power_export_kwh',
+    'total_power_export_t1_kwh',
+    'total_power_export_t2_kwh',
+    'active_power_w',
+    'active_power_l1_w',
+    'active_power_l2_w',
+    'active_power_l3_w',
+]
+P1_INTEGER_KEYS = {'active_tariff'}
+
+# Sampler: (connect, read) timeout of a reading, which should be well below the interval
+SAMPLE_TIMEOUT = (1, 2)
 
 
 @task
 def fetch_p1_meter_data():
     url = os.getenv("HW_P1_ENDPOINT")
     data = fetch_json(url)
+    # Time of the reading, rather than when it is written (it may be spooled first)
+    data['created_at'] = datetime.now(tz=timezone.utc).replace(microsecond=0)
     return data
 
 @task
 def process_p1_meter_data(data):
     # Filter the keys that we want
-    keys = [
-        'active_tariff',
-        'total_power_import_kwh',
-        'total_power_import_t1_kwh',
-        'total_power_import_t2_kwh',
-        'total_power_export_kwh',
-        'total_power_export_t1_kwh',
-        'total_power_export_t2_kwh',
-        'active_power_w',
-        'active_power_l1_w',
-        'active_power_l2_w',
-        'active_power_l3_w',
-    ]
-    data = { key: data[key] for key in keys }
+    data = { key: data[key] for key in ['created_at'] + P1_KEYS }
     return data
 
+def track_peak_demand(tracker: PeakTracker, data: dict, alert=send_peak_alert) -> list[dict]:
+    """Update the quarter-hour peak with a reading, and alert on a likely new monthly peak.
+        Returns the quarters that ended, for the <table>_quarter table."""
+    quarters = tracker.update(data['created_at'], data['total_power_import_kwh'])
+    projection = tracker.check_alert(data['active_power_w'])
+    if projection is not None:
+        alert(tracker, projection)
+    return quarters
+
 @task
 def store_p1_meter_data(data):
-    # Write the data to the database
+    # Write the data to the database, through the local spool
     connection = os.getenv("DATABASE_CONNECTION")
     table_name = os.getenv("HW_P1_TABLE")
-    write_to_database(connection, table_name, data)
+    tracker = load_tracker(table_name)
+    quarters = track_peak_demand(tracker, data)
+    store_tracker(table_name, tracker)
+    if quarters:
+        spool_rows(f"{table_name}_quarter", quarters)
+    write_to_database_spooled(connection, table_name, data)
 
 @flow(name="p1_meter data ETL")
 def p1_meter_etl():
@@ -45,5 +75,153 @@ def p1_meter_etl():
     processed_data = process_p1_meter_data(data)
     store_p1_meter_data(processed_data)
 
+
+class ReadingRing:
+    """Fixed-size ring of readings, stored as a timestamp (ms) and a row of
+        float values each in preallocated numpy arrays. When it is full, the
+        oldest reading is overwritten, so memory use never grows."""
+
+    def __init__(self, capacity: int, width: int):
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, width), dtype=np.float64)
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+
+    def append(self, timestamp_ms: int, values: list[float]):
+        capacity = len(self.times)
+        index = (self.start + self.count) % capacity
+        self.times[index] = timestamp_ms
+        self.values[index] = values
+        if self.count < capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % capacity
+            self.dropped += 1
+
+    def pop_all(self) -> tuple[np.ndarray, np.ndarray]:
+        """Remove and return all readings, oldest first."""
+        indices = (self.start + np.arange(self.count)) % len(self.times)
+        times, values = self.times[indices], self.values[indices]
+        self.start = self.count = 0
+        return times, values
+
+
+class P1Sampler:
+    """Long-running P1 meter sampler: reads the meter every `interval` seconds
+        over a kept-alive connection, keeps the readings in a ReadingRing and
+        writes them to the database (through the spool) in one batch every
+        `flush_interval` seconds, from a separate thread.
+    """
+
+    def __init__(self, interval: float = 1.0, flush_interval: float = 60.0):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.url = os.getenv("HW_P1_ENDPOINT")
+        self.connection = os.getenv("DATABASE_CONNECTION")
+        self.table_name = os.getenv("HW_P1_TABLE")
+        # Room for two flush intervals, in case a flush is slow
+        self.ring = ReadingRing(2 * int(flush_interval / interval) + 1, len(P1_KEYS))
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.errors = 0
+        self.last_error = None
+        self.tracker = load_tracker(self.table_name)
+        self.quarters = []
+
+    def sample(self):
+        timestamp_ms = time.time_ns() // 1_000_000
+        try:
+            response = get(self.url, timeout=SAMPLE_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            # Incomplete readings are dropped, like the 5 minute flow does
+            missing = [key for key in P1_KEYS if data.get(key) is None]
+            if missing:
+                raise ValueError(f"Incomplete reading, missing {missing}")
+            values = [data[key] for key in P1_KEYS]
+        except Exception as err:
+            # Counted and logged once per flush, to not flood the log when the meter is offline
+            self.errors += 1
+            self.last_error = err
+            return
+        with self.lock:
+            self.ring.append(timestamp_ms, values)
+            reading = {'created_at': datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc), **data}
+            self.quarters.extend(track_peak_demand(self.tracker, reading, alert=self.send_alert))
+
+    def send_alert(self, tracker: PeakTracker, projection: float):
+        # In the background (with a copy of the tracker), so a slow notification doesn't hold up sampling
+        threading.Thread(target=send_peak_alert, args=(PeakTracker(tracker.to_dict()), projection),
+                         daemon=True).start()
+
+    def flush(self):
+        start = time.perf_counter()
+        with self.lock:
+            times, values = self.ring.pop_all()
+            dropped, self.ring.dropped = self.ring.dropped, 0
+            quarters, self.quarters = self.quarters, []
+            store_tracker(self.table_name, self.tracker)
+        if quarters:
+            spool_rows(f"{self.table_name}_quarter", quarters)
+        errors, self.errors = self.errors, 0
+        if errors:
+            logging.warning(f"{errors} failed readings, last error: {self.last_error}")
+        if dropped:
+            logging.warning(f"Buffer full, {dropped} readings dropped")
+        if not len(times):
+            return
+
+        rows = []
+        for timestamp_ms, reading in zip(times.tolist(), values.tolist()):
+            row = {'created_at': datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)}
+            for key, value in zip(P1_KEYS, reading):
+                row[key] = int(value) if key in P1_INTEGER_KEYS else value
+            rows.append(row)
+        try:
+            write_to_database_spooled(self.connection, self.table_name, rows)
+            outcome = "ok"
+        except Exception as err:
+            # The readings are in the spool, the next flush drains them
+            logging.error(f"Flush failed: {err}")
+            outcome = "error"
+        record("p1_sampler.flush", time.perf_counter() - start, outcome,
+               readings=len(rows), errors=errors, dropped=dropped)
+        flush_metrics()
+
+    def run_flusher(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def run(self):
+        logging.info(f"Sampling {self.url} every {self.interval}s, writing every {self.flush_interval}s")
+        flusher = threading.Thread(target=self.run_flusher, daemon=True)
+        flusher.start()
+        next_sample = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self.sample()
+                # Keep to the interval; skip samples rather than catching up after a slow reading
+                next_sample = max(next_sample + self.interval, time.monotonic())
+                self.stop_event.wait(next_sample - time.monotonic())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event.set()
+            flusher.join()
+            self.flush()
+
+
 if __name__ == "__main__":
-    p1_meter_etl()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sampler', action='store_true', help="keep running and sample the meter every interval")
+    parser.add_argument('--interval', type=float, default=float(os.getenv("HW_P1_SAMPLE_INTERVAL", "1")),
+                        help="sampler interval in seconds")
+    parser.add_argument('--flush-interval', type=float, default=float(os.getenv("HW_P1_FLUSH_INTERVAL", "60")),
+                        help="seconds between writes of the sampled readings to the database")
+    args = parser.parse_args()
+    if args.sampler:
+        logging.basicConfig(level=logging.INFO)
+        P1Sampler(interval=args.interval, flush_interval=args.flush_interval).run()
+    else:
+        p1_meter_etl()
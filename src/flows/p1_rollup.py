@@ -0,0 +1,115 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from prefect import flow, task
+import os
+from datetime import datetime, timedelta, timezone
+from common.database_utils import get_engine, get_watermark, set_watermark
+from common.metrics_utils import measure
+
+# Rollup tables are named after the raw table, e.g. p1_meter_minute (see sql/create_tables_p1_meter_rollups.pgsql)
+BUCKET_SIZES = ['minute', 'hour', 'day']
+
+# Buckets (days in particular) follow the local time
+ROLLUP_TIMEZONE = os.getenv("HW_P1_TIMEZONE", "Europe/Amsterdam")
+
+# Rows younger than this are left for the next run, so readings that arrive a bit
+# late (e.g. from the spool) are still included. Rebuild after longer outages.
+ROLLUP_DELAY = timedelta(minutes=10)
+
+# Per row, the counters' increase since the previous row is added to the row's bucket.
+# The previous row of the first new row is included (and then left out) for that.
+ROLLUP_QUERY = """
+WITH deltas AS (
+    SELECT
+        created_at,
+        active_power_w, active_power_l1_w, active_power_l2_w, active_power_l3_w,
+        greatest(total_power_import_kwh - lag(total_power_import_kwh) OVER w, 0) AS import_kwh,
+        greatest(total_power_import_t1_kwh - lag(total_power_import_t1_kwh) OVER w, 0) AS import_t1_kwh,
+        greatest(total_power_import_t2_kwh - lag(total_power_import_t2_kwh) OVER w, 0) AS import_t2_kwh,
+        greatest(total_power_export_kwh - lag(total_power_export_kwh) OVER w, 0) AS export_kwh,
+        greatest(total_power_export_t1_kwh - lag(total_power_export_t1_kwh) OVER w, 0) AS export_t1_kwh,
+        greatest(total_power_export_t2_kwh - lag(total_power_export_t2_kwh) OVER w, 0) AS export_t2_kwh
+    FROM {source}
+    WHERE created_at >= coalesce((SELECT max(created_at) FROM {source} WHERE created_at <= :start), '-infinity')
+        AND created_at <= :end
+    WINDOW w AS (ORDER BY created_at)
+)
+INSERT INTO {target} AS t (bucket, samples, import_kwh, import_t1_kwh, import_t2_kwh,
+    export_kwh, export_t1_kwh, export_t2_kwh, active_power_w_sum, active_power_w_max,
+    active_power_l1_w_max, active_power_l2_w_max, active_power_l3_w_max)
+SELECT
+    date_trunc(:bucket_size, created_at, :timezone),
+    count(*),
+    coalesce(sum(import_kwh), 0), coalesce(sum(import_t1_kwh), 0), coalesce(sum(import_t2_kwh), 0),
+    coalesce(sum(export_kwh), 0), coalesce(sum(export_t1_kwh), 0), coalesce(sum(export_t2_kwh), 0),
+    sum(active_power_w), max(active_power_w),
+    max(active_power_l1_w), max(active_power_l2_w), max(active_power_l3_w)
+FROM deltas
+WHERE created_at > :start
+GROUP BY 1
+ON CONFLICT (bucket) DO UPDATE SET
+    samples = t.samples + excluded.samples,
+    import_kwh = t.import_kwh + excluded.import_kwh,
+    import_t1_kwh = t.import_t1_kwh + excluded.import_t1_kwh,
+    import_t2_kwh = t.import_t2_kwh + excluded.import_t2_kwh,
+    export_kwh = t.export_kwh + excluded.export_kwh,
+    export_t1_kwh = t.export_t1_kwh + excluded.export_t1_kwh,
+    export_t2_kwh = t.export_t2_kwh + excluded.export_t2_kwh,
+    active_power_w_sum = t.active_power_w_sum + excluded.active_power_w_sum,
+    active_power_w_max = greatest(t.active_power_w_max, excluded.active_power_w_max),
+    active_power_l1_w_max = greatest(t.active_power_l1_w_max, excluded.active_power_l1_w_max),
+    active_power_l2_w_max = greatest(t.active_power_l2_w_max, excluded.active_power_l2_w_max),
+    active_power_l3_w_max = greatest(t.active_power_l3_w_max, excluded.active_power_l3_w_max)
+"""
+
+
+@task
+def rollup_p1_meter(connection: str, table_name: str, until: datetime, rebuild_from: datetime = None) -> dict:
+    """Fold the rows after the watermark (up to `until`) into the minute, hour and day tables.
+        With rebuild_from, the buckets from that time on are removed and rolled up again."""
+    from sqlalchemy import text
+    engine = get_engine(connection)
+    quote = engine.dialect.identifier_preparer.quote
+    job = f"rollup_{table_name}"
+    with measure("p1.rollup", table=table_name) as metric, engine.begin() as conn:
+        start = get_watermark(conn, job)
+        if rebuild_from is not None:
+            # Remove whole (day) buckets, and roll up from the start of the first one
+            rebuild_from = conn.execute(text("SELECT date_trunc('day', :time, :timezone)"),
+                                        {"time": rebuild_from, "timezone": ROLLUP_TIMEZONE}).scalar_one()
+            for bucket_size in BUCKET_SIZES:
+                conn.execute(text(f"DELETE FROM {quote(f'{table_name}_{bucket_size}')} WHERE bucket >= :start"),
+                             {"start": rebuild_from})
+            rebuild_start = conn.execute(text(f"SELECT max(created_at) FROM {quote(table_name)} WHERE created_at < :start"),
+                                         {"start": rebuild_from}).scalar_one()
+            # Rows after the watermark have not been rolled up yet, so never start later than it
+            if start is not None:
+                start = rebuild_start if rebuild_start is None else min(start, rebuild_start)
+
+        end = conn.execute(text(f"SELECT max(created_at) FROM {quote(table_name)} WHERE created_at <= :until"),
+                           {"until": until}).scalar_one()
+        if end is None or (start is not None and end <= start):
+            print("No new rows to roll up")
+            return {"start": start, "end": start, "buckets": {}}
+
+        params = {"start": start or datetime.min.replace(tzinfo=timezone.utc), "end": end, "timezone": ROLLUP_TIMEZONE}
+        buckets = {}
+        for bucket_size in BUCKET_SIZES:
+            query = ROLLUP_QUERY.format(source=quote(table_name), target=quote(f"{table_name}_{bucket_size}"))
+            buckets[bucket_size] = conn.execute(text(query), {**params, "bucket_size": bucket_size}).rowcount
+        set_watermark(conn, job, end)
+        metric["buckets"] = buckets
+    result = {"start": start, "end": end, "buckets": buckets}
+    print(f"Rolled up {table_name}: {result}")
+    return result
+
+@flow(name="p1_meter rollup")
+def p1_meter_rollup(rebuild_from: datetime = None):
+    connection = os.getenv("DATABASE_CONNECTION")
+    table_name = os.getenv("HW_P1_TABLE")
+    until = datetime.now(tz=timezone.utc) - ROLLUP_DELAY
+    rollup_p1_meter(connection, table_name, until, rebuild_from)
+
+if __name__ == "__main__":
+    p1_meter_rollup()
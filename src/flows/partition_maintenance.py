@@ -0,0 +1,49 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from prefect import flow, task
+import os
+from datetime import datetime, timezone
+from common.database_utils import get_engine, invalidate_tables, get_time_series_tables
+from common.partition_utils import (add_months, is_partitioned, get_partitions, get_ranges_end,
+                                    create_partitions, detach_partitions, ensure_default_partition,
+                                    ensure_brin_index)
+
+# Monthly partitions are created this many months ahead
+MONTHS_AHEAD = 3
+
+
+@task
+def maintain_partitions(connection: str, table_name: str, column: str,
+                        months_ahead: int = MONTHS_AHEAD, detach_after_months: int = None) -> dict:
+    """Create the partitions of the coming months and the BRIN index, and
+        detach partitions older than detach_after_months (if given)."""
+    this_month = datetime.now(tz=timezone.utc).date().replace(day=1)
+    engine = get_engine(connection)
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table_name):
+            print(f"{table_name} is not partitioned, skipping (see sql/create_table_p1_meter_partitioned.pgsql)")
+            return {}
+        ensure_brin_index(conn, table_name, column)
+        ensure_default_partition(conn, table_name)
+        # Fill gaps as well, from the first existing partition on, but after a converted table
+        first_month = min([*get_partitions(conn, table_name), this_month])
+        ranges_end = get_ranges_end(conn, table_name)
+        if ranges_end is not None:
+            first_month = max(first_month, ranges_end)
+        result = {"created": create_partitions(conn, table_name, first_month,
+                                               add_months(this_month, months_ahead), column)}
+        if detach_after_months is not None:
+            result["detached"] = detach_partitions(conn, table_name, add_months(this_month, -detach_after_months))
+    invalidate_tables(connection, table_name)
+    print(f"{table_name}: {result}")
+    return result
+
+@flow(name="Partition maintenance")
+def partition_maintenance(months_ahead: int = MONTHS_AHEAD, detach_after_months: int = None):
+    connection = os.getenv("DATABASE_CONNECTION")
+    for table_name, column in get_time_series_tables().items():
+        maintain_partitions(connection, table_name, column, months_ahead, detach_after_months)
+
+if __name__ == "__main__":
+    partition_maintenance()
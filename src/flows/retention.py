@@ -0,0 +1,139 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from prefect import flow, task
+import os
+from datetime import datetime, timedelta, timezone
+from common.database_utils import get_engine, invalidate_tables, get_watermark, set_watermark
+from common.metrics_utils import measure
+
+# Raw rows are kept for 30 days, then downsampled to one row per 5 minutes,
+# and after a year to one row per hour
+DEFAULT_TIERS = [
+    {"after_days": 30, "resolution_minutes": 5},
+    {"after_days": 365, "resolution_minutes": 60},
+]
+
+# Rows are downsampled one day at a time, each day in its own transaction
+CHUNK = timedelta(days=1)
+
+
+def get_retention_policies() -> dict[str, dict]:
+    """Per table: its time column, the cumulative counters (the last value of a bucket
+        is kept, so totals and deltas stay exact) and the instantaneous values (averaged)."""
+    policies = {
+        os.getenv("HW_P1_TABLE"): {
+            "time_column": "created_at",
+            "last": ['active_tariff', 'total_power_import_kwh', 'total_power_import_t1_kwh',
+                     'total_power_import_t2_kwh', 'total_power_export_kwh', 'total_power_export_t1_kwh',
+                     'total_power_export_t2_kwh'],
+            "mean": ['active_power_w', 'active_power_l1_w', 'active_power_l2_w', 'active_power_l3_w'],
+        },
+        os.getenv("HW_WATER_TABLE"): {
+            "time_column": "created_at",
+            "last": ["total_liter_m3"],
+            "mean": [],
+        },
+        os.getenv("EN_DB_TABLE"): {
+            "time_column": "datetime",
+            "last": ["wh_lifetime"],
+            "mean": ["w_now"],
+        },
+    }
+    return {table: policy for table, policy in policies.items() if table}
+
+def get_downsample_query(quote, table_name: str, policy: dict) -> str:
+    """Replace the rows of a time range by one row per bucket, in one statement:
+        at the time of the last row of the bucket, with the last value of the
+        counters and the average of the other values."""
+    time_column = quote(policy["time_column"])
+    columns = [time_column] + [quote(column) for column in policy["last"] + policy["mean"]]
+    aggregates = [f"max({time_column})"]
+    aggregates += [f"(array_agg({quote(column)} ORDER BY {time_column} DESC))[1]" for column in policy["last"]]
+    aggregates += [f"avg({quote(column)})" for column in policy["mean"]]
+    return f"""
+        WITH removed AS (
+            DELETE FROM {quote(table_name)}
+            WHERE {time_column} >= :start AND {time_column} < :end
+            RETURNING *
+        )
+        INSERT INTO {quote(table_name)} ({', '.join(columns)})
+        SELECT {', '.join(aggregates)}
+        FROM removed
+        GROUP BY date_bin(:resolution, {time_column}, TIMESTAMPTZ '2000-01-01 00:00:00+00')
+        RETURNING 1
+    """
+
+def get_table_stats(conn, table_name: str) -> tuple[int, int]:
+    """Size in bytes (including indexes and all partitions) and estimated number of rows."""
+    from sqlalchemy import text
+    size, rows = conn.execute(text(
+        "SELECT coalesce(sum(pg_total_relation_size(c.oid)), 0), coalesce(sum(greatest(c.reltuples, 0)), 0) "
+        "FROM pg_class c WHERE c.oid = to_regclass(:table) "
+        "OR c.oid IN (SELECT relid FROM pg_partition_tree(to_regclass(:table)))"),
+        {"table": table_name}).one()
+    return int(size), int(rows)
+
+@task
+def apply_retention(connection: str, table_name: str, policy: dict, tiers: list[dict], now: datetime) -> dict:
+    """Downsample the rows of each tier that are older than its age, from where the
+        previous run stopped (a watermark per tier) on, a day per transaction."""
+    from sqlalchemy import text
+    engine = get_engine(connection)
+    quote = engine.dialect.identifier_preparer.quote
+    query = text(get_downsample_query(quote, table_name, policy))
+    time_column = quote(policy["time_column"])
+    result = {"removed": 0, "tiers": {}}
+    with engine.connect() as conn:
+        size_before, rows_before = get_table_stats(conn, table_name)
+    for tier in tiers:
+        job = f"retention_{table_name}_{tier['resolution_minutes']}min"
+        resolution = timedelta(minutes=tier["resolution_minutes"])
+        # Whole days (UTC), so no bucket spans two chunks
+        cutoff = (now - timedelta(days=tier["after_days"])).replace(hour=0, minute=0, second=0, microsecond=0)
+        removed = 0
+        while True:
+            with measure("retention.chunk", table=table_name) as metric, engine.begin() as conn:
+                start = get_watermark(conn, job)
+                if start is None:
+                    first = conn.execute(text(f"SELECT min({time_column}) FROM {quote(table_name)}")).scalar()
+                    if first is None:
+                        break
+                    start = first.replace(hour=0, minute=0, second=0, microsecond=0)
+                end = min(start + CHUNK, cutoff)
+                if end <= start:
+                    break
+                before = conn.execute(text(f"SELECT count(*) FROM {quote(table_name)} "
+                                           f"WHERE {time_column} >= :start AND {time_column} < :end"),
+                                      {"start": start, "end": end}).scalar_one()
+                after = len(conn.execute(query, {"start": start, "end": end, "resolution": resolution}).all())
+                set_watermark(conn, job, end)
+                removed += before - after
+                metric["rows"] = before - after
+        result["tiers"][job] = {"cutoff": cutoff.isoformat(), "removed": removed}
+        result["removed"] += removed
+
+    if result["removed"]:
+        # Make the space of the removed rows available again (VACUUM can't run in a transaction)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"VACUUM (ANALYZE) {quote(table_name)}"))
+    with engine.connect() as conn:
+        size_after, _ = get_table_stats(conn, table_name)
+    # Removed rows leave free space that new rows reuse, rather than shrinking the files
+    result["size_before"] = size_before
+    result["size_after"] = size_after
+    result["reclaimed"] = size_before * result["removed"] // rows_before if rows_before else 0
+    invalidate_tables(connection, table_name)
+    print(f"{table_name}: removed {result['removed']} rows, reclaimed about {result['reclaimed'] / 1e6:.1f} MB "
+          f"(size {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB), {result['tiers']}")
+    return result
+
+@flow(name="Retention")
+def retention(tiers: list[dict] = None):
+    connection = os.getenv("DATABASE_CONNECTION")
+    now = datetime.now(tz=timezone.utc)
+    for table_name, policy in get_retention_policies().items():
+        apply_retention(connection, table_name, policy, tiers or policy.get("tiers", DEFAULT_TIERS), now)
+
+if __name__ == "__main__":
+    retention()
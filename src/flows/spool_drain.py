@@ -0,0 +1,18 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from prefect import flow
+import os
+from common.spool_utils import drain_spool, get_spool_size, get_quarantine_size
+
+
+@flow(name="Spool drain")
+def spool_drain():
+    """Write readings that were spooled while the database was unreachable."""
+    connection = os.getenv("DATABASE_CONNECTION")
+    print(f"Spooled rows: {get_spool_size()}")
+    result = drain_spool(connection)
+    print(f"Drained: {result}, still spooled: {get_spool_size()}, quarantined: {get_quarantine_size()}")
+
+if __name__ == "__main__":
+    spool_drain()
@@ -3,11 +3,10 @@ load_dotenv()
 
 from datetime import timedelta
 import os
-import requests
 import numpy as np
-import cv2
 from prefect import task
 from prefect.cache_policies import INPUTS, TASK_SOURCE
+from common.api_utils import get
 
 
 @task(
@@ -23,7 +22,7 @@ def fetch_sunspot_image() -> bytes:
         Raw image data as bytes
     """
     url = os.environ["EIDASH_SUNSPOTS_URL"]
-    response = requests.get(url)
+    response = get(url)
     response.raise_for_status()
     return response.content
 
@@ -38,6 +37,8 @@ def process_sunspot_image(raw_data: bytes) -> np.ndarray:
     Returns:
         Processed image as numpy array (72x72)
     """
+    import cv2  # Heavy, so only imported when actually processing
+
     # Decode raw data
     data = np.asarray(bytearray(raw_data), dtype="uint8")
     img_original = cv2.imdecode(data, cv2.IMREAD_COLOR)
@@ -93,6 +94,8 @@ def get_sunspot_image() -> np.ndarray:
     return processed_image
 
 def main():
+    import cv2
+
     # Test run, write processed image to disk
     raw_data = fetch_sunspot_image()
     processed_image = process_sunspot_image(raw_data)
@@ -1,26 +1,30 @@
 import os
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 load_dotenv()
 from prefect import flow, task
-from common.database_utils import write_to_database
+from common.spool_utils import write_to_database_spooled
 from common.api_utils import fetch_json
 
 
 @task
 def fetch_data():
     url = os.getenv("HW_WATER_ENDPOINT")
-    return fetch_json(url)
+    data = fetch_json(url)
+    # Time of the reading, rather than when it is written (it may be spooled first)
+    data['created_at'] = datetime.now(tz=timezone.utc).replace(microsecond=0)
+    return data
 
 @task
 def process_data(data):
-    keys = ['total_liter_m3']
+    keys = ['created_at', 'total_liter_m3']
     return {key: data[key] for key in keys if key in data}
 
 @task
 def store_data(data):
     database_connection = os.getenv("DATABASE_CONNECTION")
     table_name = os.getenv("HW_WATER_TABLE")
-    write_to_database(database_connection, table_name, data)
+    write_to_database_spooled(database_connection, table_name, data)
 
 @flow(name="Water Meter ETL")
 def watermeter_etl():
@@ -6,7 +6,7 @@ from prefect.cache_policies import TASK_SOURCE, INPUTS
 import os
 from datetime import datetime, timedelta, timezone
 from common.api_utils import fetch_json
-from common.database_utils import write_to_database
+from common.database_utils import upsert_to_database
 from common.prefect_utils import maybe_invalidate_cache
 
 
@@ -55,7 +55,7 @@ def process_weerlive_data(data: dict) -> dict:
 def store_weerlive_data(data: dict):
     connection = os.getenv("DATABASE_CONNECTION")
     table_name = os.getenv("WL_TABLE")
-    write_to_database(connection, table_name, data, ignore_unique_error=True)
+    upsert_to_database(connection, table_name, data)
 
 @flow
 def weerlive_data_etl():
@@ -2,7 +2,7 @@
 from dotenv import load_dotenv
 load_dotenv()
 from prefect import flow, task
-import requests
+from common.api_utils import get, fetch_to_file
 import time
 import re
 import json
@@ -39,9 +39,8 @@ def is_already_processed(videoId) -> bool:
 def download_file(file_url, file_name) -> None:
     path = get_path_in_output_dir(file_name)
     print("Downloading to", path)
-    response = requests.get(file_url)
-    with open(path, 'wb') as target_file:
-        target_file.write(response.content)
+    # Stream to disk; the files can be large and the server slow
+    fetch_to_file(file_url, path, timeout=(10, 120))
 
 @task
 def log_download(videoId, file_title) -> None:
@@ -62,7 +61,7 @@ def api_get_playlist_videos(playlist_id, api_key):
     # Note that for some reason, the sorting of the playlist
     # on ZT matters; only 100 entries are returned, so make sure
     # the playlist is sorted by "Date added (newest)" on ZT
-    response = requests.request("GET", url, headers=headers, params=querystring)
+    response = get(url, headers=headers, params=querystring)
     print(f"API response status code: {response.status_code}")
     return response.json()
 
@@ -76,7 +75,7 @@ def api_get_video_info(video_id, api_key):
         "X-RapidAPI-Key": api_key,
         "X-RapidAPI-Host": api_host
     }
-    response = requests.request("GET", url, headers=headers, params=querystring)
+    response = get(url, headers=headers, params=querystring)
     print(f"API response status code: {response.status_code}")
     return response.json()
 
@@ -89,7 +88,7 @@ def api_video_to_mp3(video_id: str, api_key: str) -> dict:
       "X-RapidAPI-Key": api_key,
       "X-RapidAPI-Host": api_host
     }
-    response = requests.get(url, headers=headers, params=querystring)
+    response = get(url, headers=headers, params=querystring)
     return response.json()
 
 @task